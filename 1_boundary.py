@@ -6,31 +6,83 @@ https://www.geoboundaries.org/api.html
 
 import json
 import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import geopandas as gpd
+import numpy as np
 import requests
 import shapely
 
-from config import get_config
+from catalog import BoundaryCatalog
+from config import get_config, overwrite_requested
+from download_cache import PINNED_URL_PATTERN, DownloadCache
+from http_utils import download_file, get_json_cached, http_get
+from vector_utils import (
+    FORMAT_EXTENSIONS,
+    BoundaryBatchWriter,
+    iter_boundary_batches,
+    read_boundary,
+    simplify_boundary,
+    write_boundary,
+)
 
 
 def get_api_url(url: str) -> Dict:
     """
     Get the API URL and return the JSON object of content
 
+    Requests go through the shared connection-pooled session, which retries
+    transient failures with backoff.
+
     Args:
         url (str): The URL to fetch the API data from.
 
     Returns:
         dict: The JSON object of content.
     """
-    response = requests.get(url)
+    response = http_get(url)
+    response.raise_for_status()
     content = response.json()
     return content
 
 
+def get_url_commit(url: str) -> Optional[str]:
+    """
+    Get the commit hash embedded in a geoBoundaries download URL
+
+    Args:
+        url (str): The download URL.
+
+    Returns:
+        str: The commit hash, or None if the URL is not pinned to a commit.
+    """
+    match = PINNED_URL_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def link_or_copy(src_path: Path, dst_path: Path):
+    """
+    Hardlink a file, falling back to a copy across filesystems
+
+    Args:
+        src_path (Path): Existing file.
+        dst_path (Path): Path to create, replaced if it exists.
+    """
+    dst_path.unlink(missing_ok=True)
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copy2(src_path, dst_path)
+
+
 class geoBoundariesDataset:
     name = "geoBoundaries"
 
@@ -42,6 +94,15 @@ class geoBoundariesDataset:
         output_dir: str,
         overwrite_existing: bool,
         dl_iso3_list: Optional[List[str]] = None,
+        max_workers: int = 1,
+        output_formats: Optional[List[str]] = None,
+        parquet_row_group_size: int = 10000,
+        cache_dir: Optional[str] = None,
+        cache_max_size_gb: float = 20,
+        sync_from: Optional[str] = None,
+        streaming_ingest: bool = False,
+        stream_batch_size: int = 10000,
+        simplify_tolerances: Optional[List[float]] = None,
     ):
         # Path, imported from Python's pathlib library, makes it
         # convenient to build filepaths using the / operator
@@ -49,13 +110,62 @@ class geoBoundariesDataset:
             Path(output_dir) / f"{version}_{gb_data_hash}_{gb_web_hash}"
         )
 
+        self.gb_web_hash = gb_web_hash
+
         self.overwrite_existing = overwrite_existing
 
         # leave blank / set to None to download all ISO3 boundaries
         self.dl_iso3_list = dl_iso3_list
 
+        # number of items downloaded and processed concurrently
+        self.max_workers = max_workers
+
+        # formats each boundary is written to, the first is used as the
+        # primary path in the metadata
+        self.output_formats = output_formats or ["geojson"]
+        for fmt in self.output_formats:
+            if fmt not in FORMAT_EXTENSIONS:
+                raise ValueError(f"Unsupported output format: {fmt}")
+        self.parquet_row_group_size = parquet_row_group_size
+
+        # downloads are cached by content and shared between releases, so
+        # files that did not change between releases are not downloaded again
+        if cache_dir:
+            self.cache = DownloadCache(
+                cache_dir, max_size=int(cache_max_size_gb * 1024**3)
+            )
+        else:
+            self.cache = None
+
         self.api_url = f"https://raw.githubusercontent.com/wmgeolab/gbWeb/{gb_web_hash}/api/current/gbOpen/ALL/ALL/index.json"
 
+        # a local copy of the API index is kept with the release, it never
+        # needs to be revalidated when gb_web_hash is a commit hash rather
+        # than a branch name
+        self.api_cache_path = self.output_dir / "index.json"
+        self.api_pinned = (
+            re.fullmatch(r"[0-9a-f]{7,40}", gb_web_hash) is not None
+        )
+
+        # stream boundaries to disk and convert them in batches of features
+        # so memory use does not depend on the size of the boundary file
+        self.streaming_ingest = streaming_ingest
+        self.stream_batch_size = stream_batch_size
+
+        # tolerances in meters of the simplified versions of each boundary
+        # written alongside the original
+        self.simplify_tolerances = sorted(simplify_tolerances or [])
+
+        # catalog of the boundaries in this release, updated as each item's
+        # metadata is written
+        self.catalog = BoundaryCatalog(self.output_dir / "catalog.sqlite")
+
+        # previous release directory (e.g. "v6_9469f09_57dcd43") to sync
+        # from, items that have not changed since are carried over from it
+        # instead of being downloaded again
+        self.previous_dir = Path(output_dir) / sync_from if sync_from else None
+        self.unchanged_items = set()
+
         self.default_meta = {
             "name": None,
             "path": None,
@@ -71,6 +181,7 @@ class geoBoundariesDataset:
             "group_title": None,
             "group_class": None,
             "group_level": None,
+            "simplified": {},
         }
 
     def get_logger(self):
@@ -90,7 +201,9 @@ class geoBoundariesDataset:
 
         logger.info("Preparing list of boundaries to download")
 
-        api_data = get_api_url(self.api_url)
+        api_data = get_json_cached(
+            self.api_url, self.api_cache_path, immutable=self.api_pinned
+        )
 
         if self.dl_iso3_list:
             ingest_items = [
@@ -100,13 +213,284 @@ class geoBoundariesDataset:
             ingest_items = [(i,) for i in api_data]
 
         ingest_items = sorted(ingest_items, key=lambda d: d[0]["boundaryISO"])
+
+        if self.previous_dir:
+            self.unchanged_items = self.diff_release(
+                [i[0] for i in ingest_items]
+            )
+
         return ingest_items
 
-    def dl_gb_item(self, item: dict):
+    def diff_release(self, items: List[dict]) -> set:
+        """
+        Compare items against the index of the previous release
+
+        Items are matched by boundaryISO and boundaryType, and are unchanged
+        if both download URLs are pinned to the same commit.
+
+        Args:
+            items (List[dict]): Items of the current release.
+
+        Returns:
+            set: (boundaryISO, boundaryType) of the unchanged items.
+        """
+        logger = self.get_logger()
+
+        # the previous index is normally kept in the previous release
+        # directory, otherwise fetch it using the hash in the directory name
+        previous_web_hash = self.previous_dir.name.split("_")[-1]
+        previous_api_data = get_json_cached(
+            self.api_url.replace(
+                f"/gbWeb/{self.gb_web_hash}/", f"/gbWeb/{previous_web_hash}/"
+            ),
+            self.previous_dir / "index.json",
+            immutable=True,
+        )
+
+        previous_commits = {
+            (i["boundaryISO"], i["boundaryType"]): get_url_commit(
+                i["gjDownloadURL"]
+            )
+            for i in previous_api_data
+        }
+
+        new_items, changed_items, unchanged_items = set(), set(), set()
+        for item in items:
+            key = (item["boundaryISO"], item["boundaryType"])
+            commit = get_url_commit(item["gjDownloadURL"])
+            if key not in previous_commits:
+                new_items.add(key)
+            elif commit is None or commit != previous_commits[key]:
+                changed_items.add(key)
+            else:
+                unchanged_items.add(key)
+
+        logger.info(
+            f"Sync from {self.previous_dir.name}: {len(new_items)} new, "
+            f"{len(changed_items)} changed, {len(unchanged_items)} unchanged"
+        )
+        return unchanged_items
+
+    def carry_over(
+        self,
+        fname: str,
+        output_paths: List[Path],
+        json_path: Path,
+        adm_meta: dict,
+    ) -> bool:
+        """
+        Reuse the outputs of an unchanged item from the previous release
+
+        Output files are hardlinked (or copied) into the current release and
+        a new metadata file is written pointing to them.
+
+        Returns:
+            bool: True if the item was carried over.
+        """
+        logger = self.get_logger()
+
+        previous_item_dir = self.previous_dir / fname
+        previous_paths = [previous_item_dir / i.name for i in output_paths]
+        previous_json_path = previous_item_dir / json_path.name
+        if not all(i.exists() for i in [*previous_paths, previous_json_path]):
+            return False
+
+        logger.info(f"Carrying over unchanged item: {previous_item_dir}")
+
+        for src_path, dst_path in zip(previous_paths, output_paths):
+            link_or_copy(src_path, dst_path)
+
+        with open(previous_json_path, "r") as src:
+            adm_meta["spatial_extent"] = json.load(src)["spatial_extent"]
+
+        self.write_meta(adm_meta, json_path)
+
+        return True
+
+    def write_meta(self, adm_meta: dict, json_path: Path):
+        """
+        Export an item's metadata to json and add it to the catalog
+        """
+        export_adm_meta = adm_meta.copy()
+        with open(json_path, "w") as file:
+            json.dump(export_adm_meta, file, indent=4)
+
+        self.catalog.add(export_adm_meta, json_path)
+
+    def load_boundary(self, url: str) -> Optional[gpd.GeoDataFrame]:
+        """
+        Download and read a boundary file
+
+        The file is fetched through the download cache if one is configured,
+        otherwise a single response is used for both the status check and the
+        content.
+
+        Args:
+            url (str): URL of the boundary file.
+
+        Returns:
+            gpd.GeoDataFrame: The boundary data, or None if it could not be
+                downloaded or read.
+        """
+        logger = self.get_logger()
+
+        try:
+            if self.cache is not None:
+                src = self.cache.fetch(url)
+            else:
+                response = http_get(url)
+                response.raise_for_status()
+                src = response.content
+        except requests.HTTPError as e:
+            logger.error(f"{e.response.status_code}: {url}")
+            return None
+        except Exception:
+            logger.exception(f"Failed to download {url}")
+            return None
+
+        try:
+            return gpd.read_file(
+                BytesIO(src) if isinstance(src, bytes) else src
+            )
+        except:
+            try:
+                raw_json = json.loads(
+                    src if isinstance(src, bytes) else src.read_bytes()
+                )
+                return gpd.GeoDataFrame.from_features(
+                    raw_json["features"], crs="EPSG:4326"
+                )
+            except:
+                logger.error(f"Failed to read {url}")
+                return None
+
+    def stream_boundary(
+        self, url: str, item: dict, output_paths: List[Path]
+    ) -> Optional[Tuple[float, float, float, float]]:
+        """
+        Download a boundary file to disk and convert it to the output formats
+        in batches of features
+
+        The download is written to disk in chunks (or fetched through the
+        download cache) and features are read and written
+        `stream_batch_size` at a time, so peak memory stays flat regardless
+        of the size of the boundary.
+
+        Args:
+            url (str): URL of the boundary file.
+            item (dict): The geoBoundaries item.
+            output_paths (List[Path]): Paths to write the boundary to.
+
+        Returns:
+            Tuple[float, float, float, float]: Bounds of the boundary, or None
+                if it could not be downloaded or converted.
+        """
+        logger = self.get_logger()
+
+        tmp_path = None
+        try:
+            if self.cache is not None:
+                src_path = self.cache.fetch(url)
+            else:
+                tmp_dir = self.output_dir / "tmp"
+                tmp_dir.mkdir(exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=".geojson")
+                os.close(fd)
+                src_path = tmp_path
+                download_file(url, src_path)
+        except requests.HTTPError as e:
+            logger.error(f"{e.response.status_code}: {url}")
+            return None
+        except Exception:
+            logger.exception(f"Failed to download {url}")
+            return None
+
+        bounds = []
+        try:
+            writers = [
+                BoundaryBatchWriter(i, self.parquet_row_group_size)
+                for i in output_paths
+            ]
+            try:
+                for gdf in iter_boundary_batches(
+                    src_path, batch_size=self.stream_batch_size
+                ):
+                    gdf = self.add_shape_name(gdf, item)
+                    for writer in writers:
+                        writer.write(gdf)
+                    bounds.append(gdf.total_bounds)
+            finally:
+                for writer in writers:
+                    writer.close()
+        except Exception:
+            logger.exception(f"Failed to read {url}")
+            bounds = []
+        finally:
+            if tmp_path is not None:
+                os.remove(tmp_path)
+
+        if not bounds:
+            logger.error(f"No features read from {url}")
+            for output_path in output_paths:
+                output_path.unlink(missing_ok=True)
+            return None
+
+        bounds = np.array(bounds)
+        return (
+            bounds[:, 0].min(),
+            bounds[:, 1].min(),
+            bounds[:, 2].max(),
+            bounds[:, 3].max(),
+        )
+
+    def write_pyramid(
+        self, gdf: gpd.GeoDataFrame, pyramid_paths: Dict[float, List[Path]]
+    ):
+        """
+        Write simplified versions of a boundary for each tolerance
+
+        Args:
+            gdf (gpd.GeoDataFrame): The full resolution boundary data.
+            pyramid_paths (Dict[float, List[Path]]): Tolerance in meters mapped
+                to the paths to write the simplified boundary to.
+        """
+        logger = self.get_logger()
+
+        for tolerance, paths in pyramid_paths.items():
+            logger.debug(
+                f"Simplifying boundary with {tolerance:g} m tolerance"
+            )
+            simplified_gdf = simplify_boundary(gdf, tolerance)
+            for path in paths:
+                write_boundary(
+                    simplified_gdf,
+                    path,
+                    row_group_size=self.parquet_row_group_size,
+                )
+
+    def add_shape_name(
+        self, gdf: gpd.GeoDataFrame, item: dict
+    ) -> gpd.GeoDataFrame:
+        """
+        Make sure boundary data has a shapeName field
+        """
+        if "shapeName" not in gdf.columns:
+            potential_name_field = f'{item["boundaryType"]}_NAME'
+            if potential_name_field in gdf.columns:
+                gdf["shapeName"] = gdf[potential_name_field]
+            else:
+                gdf["shapeName"] = None
+        return gdf
+
+    def dl_gb_item(self, item: dict) -> bool:
         """
         Download and process a single geoBoundaries item
 
         Prepared the metadata and downloads the boundary data from geoBoundaries.
+
+        Returns:
+            bool: False if the boundary could not be downloaded or read, True
+                otherwise (including existing and carried over items).
         """
         logger = self.get_logger()
 
@@ -142,58 +526,116 @@ class geoBoundariesDataset:
         dir_path = self.output_dir / fname
         dir_path.mkdir(exist_ok=True, parents=True)
 
-        gpkg_path = dir_path / f"{fname}.gpkg"
-        adm_meta["path"] = str(gpkg_path)
+        output_paths = [
+            dir_path / f"{fname}{FORMAT_EXTENSIONS[fmt]}"
+            for fmt in self.output_formats
+        ]
+        adm_meta["path"] = str(output_paths[0])
+        adm_meta["file_extension"] = output_paths[0].suffix
+
+        # simplified versions of the boundary, the metadata maps each
+        # tolerance in meters to the path in the primary format
+        pyramid_paths = {
+            tolerance: [
+                dir_path
+                / f"{fname}_simplified_{tolerance:g}m{FORMAT_EXTENSIONS[fmt]}"
+                for fmt in self.output_formats
+            ]
+            for tolerance in self.simplify_tolerances
+        }
+        adm_meta["simplified"] = {
+            f"{tolerance:g}": str(paths[0])
+            for tolerance, paths in pyramid_paths.items()
+        }
+        all_paths = [*output_paths, *sum(pyramid_paths.values(), [])]
 
-        geojson_path = gpkg_path.with_suffix(".geojson")
-        json_path = gpkg_path.with_suffix(".meta.json")
+        json_path = dir_path / f"{fname}.meta.json"
 
         if (
-            gpkg_path.exists()
-            and geojson_path.exists()
+            all(i.exists() for i in all_paths)
             and json_path.exists()
             and not self.overwrite_existing
         ):
-            logger.info(f"Skipping existing file: {gpkg_path}")
-            return
+            logger.info(f"Skipping existing file: {output_paths[0]}")
+            self.catalog.add_from_file(json_path)
+            return True
+
+        if (
+            item["boundaryISO"],
+            item["boundaryType"],
+        ) in self.unchanged_items and self.carry_over(
+            fname, all_paths, json_path, adm_meta
+        ):
+            return True
+
+        # remove existing outputs first so that files hardlinked to a
+        # previous release are replaced rather than modified in place
+        for output_path in all_paths:
+            output_path.unlink(missing_ok=True)
 
         logger.debug(f"Downloading {commit_dl_url} boundary")
-        try:
-            gdf = gpd.read_file(commit_dl_url)
-        except:
-            if requests.get(commit_dl_url).status_code == 404:
-                logger.error(f"404: {commit_dl_url}")
-                return
-            else:
-                try:
-                    raw_json = get_api_url(commit_dl_url)
-                    gdf = gpd.GeoDataFrame.from_features(raw_json["features"])
-                except:
-                    logger.error(f"Failed to download {commit_dl_url}")
-                    return
+        if self.streaming_ingest:
+            bounds = self.stream_boundary(commit_dl_url, item, output_paths)
+            if bounds is None:
+                return False
+            if pyramid_paths:
+                # simplifying as a coverage needs all features at once, so
+                # read back the converted boundary
+                gdf = read_boundary(output_paths[0])
+        else:
+            gdf = self.load_boundary(commit_dl_url)
+            if gdf is None:
+                return False
 
-        if "shapeName" not in gdf.columns:
-            potential_name_field = f'{item["boundaryType"]}_NAME'
-            if potential_name_field in gdf.columns:
-                gdf["shapeName"] = gdf[potential_name_field]
-            else:
-                gdf["shapeName"] = None
+            gdf = self.add_shape_name(gdf, item)
+
+            for output_path in output_paths:
+                write_boundary(
+                    gdf,
+                    output_path,
+                    row_group_size=self.parquet_row_group_size,
+                )
+            bounds = gdf.total_bounds
 
-        # gdf.to_file(gpkg_path, driver="GPKG")
-        gdf.to_file(geojson_path, driver="GeoJSON")
+        if pyramid_paths:
+            self.write_pyramid(gdf, pyramid_paths)
 
         logger.debug(f"Getting bounding box for {commit_dl_url}")
-        spatial_extent = shapely.box(*gdf.total_bounds).wkt
+        spatial_extent = shapely.box(*bounds).wkt
         adm_meta["spatial_extent"] = spatial_extent
 
         # export metadata to json
-        export_adm_meta = adm_meta.copy()
-        with open(json_path, "w") as file:
-            json.dump(export_adm_meta, file, indent=4)
+        self.write_meta(adm_meta, json_path)
+
+        return True
 
-    def main(self):
+    def run_item(self, item: dict) -> bool:
+        """
+        Run `dl_gb_item` for a single item, logging rather than raising errors
+        so that one failed item does not stop the others
+
+        Returns:
+            bool: True if the item was processed without errors.
+        """
+        logger = self.get_logger()
+
+        logger.info(
+            f"Processing {item['boundaryISO']} {item['boundaryType']} boundary"
+        )
+        try:
+            return self.dl_gb_item(item)
+        except Exception:
+            logger.exception(
+                f"Failed processing {item['boundaryISO']} {item['boundaryType']}"
+            )
+            return False
+
+    def main(self) -> List[bool]:
         """
         Main function to run the geoBoundaries download process
+
+        Returns:
+            List[bool]: Whether each boundary was processed successfully.
         """
         logger = self.get_logger()
 
@@ -203,12 +645,31 @@ class geoBoundariesDataset:
         logger.info("Running boundary data download")
 
         # run the download tasks
-        for item in ingest_items:
-            logger.info(f"Processing {item[0]['boundaryISO']} boundary")
-            self.dl_gb_item(item[0])
+        # items are independent, so with multiple workers the downloads for
+        # some items overlap with the parsing and writing of others
+        if self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(self.run_item, item[0])
+                    for item in ingest_items
+                ]
+                results = [future.result() for future in as_completed(futures)]
+        else:
+            results = [self.run_item(item[0]) for item in ingest_items]
+
+        if not all(results):
+            logger.warning(
+                f"{results.count(False)} of {len(results)} boundaries failed"
+            )
+
+        # trim the cache once no cached files are in use
+        if self.cache is not None:
+            self.cache.evict()
 
         logger.info("Finished downloading boundary data")
 
+        return results
+
 
 if __name__ == "__main__":
     config = get_config()
@@ -218,6 +679,17 @@ if __name__ == "__main__":
 
     boundary_config["output_dir"].mkdir(parents=True, exist_ok=True)
 
+    # replace existing boundaries when run by the pipeline after a config
+    # change
+    boundary_config["overwrite_existing"] = (
+        boundary_config["overwrite_existing"] or overwrite_requested()
+    )
+
+    if boundary_config.get("cache_dir"):
+        boundary_config["cache_dir"] = (
+            Path(config["base_path"]) / boundary_config["cache_dir"]
+        )
+
     # set logging configuration
     logging.basicConfig(
         filename=boundary_config["output_dir"] / "boundary.log",
@@ -227,4 +699,9 @@ if __name__ == "__main__":
     )
 
     gBD = geoBoundariesDataset(**boundary_config)
-    gBD.main()
+    results = gBD.main()
+
+    # fail the stage so the pipeline does not record it as finished, or run
+    # the stages that depend on it, with boundaries missing
+    if not all(results):
+        sys.exit(1)
@@ -5,17 +5,63 @@ https://cds.climate.copernicus.eu/datasets/satellite-land-cover
 """
 
 import logging
+import multiprocessing
 import os
 import shutil
+import threading
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from itertools import islice
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from zipfile import ZipFile
 
 import cdsapi
 import numpy as np
 import rasterio
-
-from config import get_config
+from rasterio.windows import Window
+
+from config import get_config, overwrite_requested
+from landcover_products import (
+    build_fractional_cover,
+    build_transition_rasters,
+)
+from raster_utils import (
+    BlockHistogram,
+    get_aoi_bounds,
+    get_aoi_window,
+    get_cog_profile,
+    open_cog_writer,
+    plan_windows,
+)
+from reclassify import LookupReclassifier
+
+# per worker (thread or process) state used by parallel block processing
+_worker_state = threading.local()
+
+
+def _init_block_worker(input_path: str, reclassifier: LookupReclassifier):
+    """
+    Open the input raster once for each worker in the pool
+
+    Rasterio datasets cannot be shared between threads or pickled, so every
+    worker holds its own handle.
+    """
+    _worker_state.src = rasterio.open(input_path)
+    _worker_state.reclassifier = reclassifier
+
+
+def _read_map_block(window: Window):
+    """
+    Read and reclassify a single window using the worker's dataset handle
+    """
+    in_data = _worker_state.src.read(window=window)
+    return _worker_state.reclassifier(in_data)
 
 
 class ESALandcover:
@@ -31,6 +77,23 @@ class ESALandcover:
         overwrite_download: bool,
         overwrite_processing: bool,
         mapping: dict,
+        mapping_default: int = 0,
+        max_workers: Optional[int] = None,
+        pool_type: str = "process",
+        extract_netcdf: bool = True,
+        use_tmp_copies: bool = False,
+        aoi_bounds: Optional[Tuple[float, float, float, float]] = None,
+        aoi_buffer: float = 0,
+        download_workers: int = 1,
+        queue_depth: int = 0,
+        keep_downloads: bool = True,
+        output_stack: bool = False,
+        transitions: Optional[List[List[int]]] = None,
+        fraction_factor: int = 0,
+        category_map: Optional[Dict[str, int]] = None,
+        write_histograms: bool = False,
+        cog_options: Optional[dict] = None,
+        window_memory_mb: float = 32,
     ):
         self.raw_dir = Path(raw_dir)
         self.process_dir = Path(process_dir)
@@ -40,6 +103,68 @@ class ESALandcover:
         self.overwrite_download = overwrite_download
         self.overwrite_processing = overwrite_processing
 
+        # workers used to read and reclassify blocks, defaults to all cores
+        self.max_workers = max_workers or os.cpu_count()
+        if pool_type not in ("thread", "process"):
+            raise ValueError(f"Invalid pool type: {pool_type}")
+        self.pool_type = pool_type
+
+        # by default the NetCDF is extracted from the downloaded zip, reading
+        # it in place through `/vsizip/` is opt-in (avoids the extra copy,
+        # but depends on GDAL being able to seek within the zip member), and
+        # the output is written in place, copying through tmp/processed is
+        # opt-in (e.g. for slow network filesystems)
+        self.extract_netcdf = extract_netcdf
+        self.use_tmp_copies = use_tmp_copies
+
+        # optional (minx, miny, maxx, maxy) area of interest, when set only
+        # the intersecting part of the global raster is processed
+        self.aoi_bounds = aoi_bounds
+        self.aoi_buffer = aoi_buffer
+
+        # number of years requested from the CDS at the same time, each
+        # request waits in the CDS queue independently
+        self.download_workers = download_workers
+
+        # maximum number of years downloading or downloaded and waiting to
+        # be processed (0 for no limit), with keep_downloads disabled this
+        # bounds the disk space used by downloads
+        self.queue_depth = queue_depth
+        self.keep_downloads = keep_downloads
+
+        # also combine all years into a single multi-band COG, with one band
+        # per year and all bands of a tile stored together
+        self.output_stack = output_stack
+        self.stack_path = self.output_dir / "esa_lc_stack.tif"
+
+        # (from year, to year) pairs to write transition code rasters for
+        self.transition_paths = {
+            (from_year, to_year): self.output_dir
+            / f"esa_lc_transition_{from_year}_{to_year}.tif"
+            for from_year, to_year in transitions or []
+        }
+        # profile of the output COGs (see raster_utils.get_cog_profile)
+        self.cog_profile = get_cog_profile(**(cog_options or {}))
+
+        # memory budget of each window read and reclassified, native blocks
+        # are grouped into windows of whole output tiles up to this size
+        self.window_max_bytes = int(window_memory_mb * 1024**2)
+
+        # write a sidecar with the class counts of each output block, used to
+        # speed up zonal statistics for zones covering whole blocks
+        self.write_histograms = write_histograms
+
+        # aggregation factor of the fractional cover rasters (0 to disable),
+        # with a band for each class in the category map
+        self.fraction_factor = fraction_factor
+        self.fraction_classes = {v: k for k, v in (category_map or {}).items()}
+        if self.fraction_factor and not self.fraction_classes:
+            raise ValueError("Fractional cover requires a category map")
+
+        for pair in self.transition_paths:
+            if not set(pair) <= set(self.years):
+                raise ValueError(f"Transition years not processed: {pair}")
+
         self.v207_years = range(1992, 2016)
         self.v211_years = range(2016, 2022)
 
@@ -49,12 +174,15 @@ class ESALandcover:
                 f"url: https://cds.climate.copernicus.eu/api \nkey: {self.api_key}"
             )
 
-        self.cdsapi_client = cdsapi.Client()
+        # cdsapi clients are created per thread so that concurrent requests
+        # do not share a session
+        self._cdsapi_local = threading.local()
 
-        vector_mapping = {
-            int(vi): int(k) for k, v in mapping.items() for vi in v
-        }
-        self.map_func = np.vectorize(vector_mapping.get)
+        # ESA lccs_class values are uint8, unmapped values are set to the
+        # default (no data) class
+        self.reclassifier = LookupReclassifier(
+            mapping, default=mapping_default, dtype="uint8"
+        )
 
     def get_logger(self):
         """
@@ -62,8 +190,23 @@ class ESALandcover:
         """
         return logging.getLogger("dataset")
 
+    def get_cdsapi_client(self) -> cdsapi.Client:
+        """
+        Get the CDS API client for the current thread
+        """
+        if not hasattr(self._cdsapi_local, "client"):
+            self._cdsapi_local.client = cdsapi.Client()
+        return self._cdsapi_local.client
+
     def download(self, year: int):
-        """Download the ESA land cover data for a given year"""
+        """
+        Download the ESA land cover data for a given year
+
+        Returns the path to the extracted NetCDF file, or a GDAL `/vsizip/`
+        path to the NetCDF inside the downloaded zip if `extract_netcdf` is
+        not set. The NetCDF is extracted anyway if GDAL cannot open it
+        inside the zip.
+        """
         logger = self.get_logger()
 
         if year in self.v207_years:
@@ -84,20 +227,37 @@ class ESALandcover:
                 "version": [version],
                 "year": [str(year)],
             }
-            self.cdsapi_client.retrieve(
-                "satellite-land-cover", dl_meta, dl_path
+            # download to a temporary file so an interrupted download is not
+            # mistaken for a complete one
+            part_path = dl_path.with_name(f"{dl_path.name}.part")
+            logger.info(f"Requesting {year} from the CDS")
+            self.get_cdsapi_client().retrieve(
+                "satellite-land-cover", dl_meta, str(part_path)
             )
+            os.replace(part_path, dl_path)
+            logger.info(f"Download complete: {dl_path}")
 
         zipfile_path = dl_path.as_posix()
 
-        logger.info(f"Unzipping {zipfile_path}...")
-
         with ZipFile(zipfile_path) as zf:
             netcdf_namelist = [i for i in zf.namelist() if i.endswith(".nc")]
             if len(netcdf_namelist) != 1:
                 raise Exception(
                     f"Multiple or no ({len(netcdf_namelist)}) net cdf files found in zip for {year}"
                 )
+
+            if not self.extract_netcdf:
+                vsizip_path = f"/vsizip/{zipfile_path}/{netcdf_namelist[0]}"
+                try:
+                    with rasterio.open(vsizip_path):
+                        return vsizip_path
+                except rasterio.errors.RasterioIOError as e:
+                    logger.warning(
+                        f"Unable to read {vsizip_path} ({e}), extracting it"
+                    )
+
+            logger.info(f"Unzipping {zipfile_path}...")
+
             output_file_path = (
                 self.raw_dir / "uncompressed" / netcdf_namelist[0]
             )
@@ -109,7 +269,102 @@ class ESALandcover:
 
         return output_file_path
 
-    def process(self, input_path: Path, output_path: Path):
+    def remove_download(self, year: int, input_path: Union[Path, str]):
+        """
+        Remove the downloaded (and extracted) files for a year once it has
+        been processed
+        """
+        logger = self.get_logger()
+
+        dl_path = self.raw_dir / "compressed" / f"{year}.zip"
+        logger.info(f"Removing download: {dl_path}")
+        dl_path.unlink(missing_ok=True)
+        if not str(input_path).startswith("/vsizip/"):
+            Path(input_path).unlink(missing_ok=True)
+
+    def map_windows(
+        self, input_path: str, windows: Iterable[Window]
+    ) -> Iterator[Tuple[Window, np.ndarray]]:
+        """
+        Read and reclassify windows of a raster
+
+        Blocks are read and reclassified on a pool of `max_workers` threads or
+        processes. Results are yielded in the same order as the windows so
+        that a single writer can consume them, and at most two windows per
+        worker are in flight at once to bound memory use.
+
+        GDAL's netCDF driver holds a global lock around netCDF/HDF5 calls, so
+        with threads only one worker reads and decompresses at a time. Use
+        processes (the default) for NetCDF input.
+
+        Args:
+            input_path (str): Path to the raster to read.
+            windows (Iterable[Window]): Windows to read.
+
+        Yields:
+            Tuple[Window, np.ndarray]: The window and its reclassified data.
+        """
+        if self.max_workers <= 1:
+            with rasterio.open(input_path) as src:
+                for window in windows:
+                    yield window, self.reclassifier(src.read(window=window))
+            return
+
+        executor_kwargs = {
+            "max_workers": self.max_workers,
+            "initializer": _init_block_worker,
+            "initargs": (input_path, self.reclassifier),
+        }
+        if self.pool_type == "process":
+            # forked workers would inherit GDAL's state (open handles, block
+            # cache and locks) and the download threads of main()
+            start_method = (
+                "forkserver"
+                if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn"
+            )
+            executor = ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context(start_method),
+                **executor_kwargs,
+            )
+        else:
+            executor = ThreadPoolExecutor(**executor_kwargs)
+        windows = iter(windows)
+        with executor:
+            pending = deque(
+                (window, executor.submit(_read_map_block, window))
+                for window in islice(windows, self.max_workers * 2)
+            )
+            while pending:
+                window, future = pending.popleft()
+                out_data = future.result()
+                for next_window in islice(windows, 1):
+                    pending.append(
+                        (
+                            next_window,
+                            executor.submit(_read_map_block, next_window),
+                        )
+                    )
+                yield window, out_data
+
+    def copy_input(self, input_path: Union[Path, str], tmp_input_path: Path):
+        """
+        Copy an input NetCDF to the tmp processing directory
+
+        Inputs given as `/vsizip/` paths are extracted from their zip.
+        """
+        input_path = str(input_path)
+        if input_path.startswith("/vsizip/"):
+            zipfile_path, member = input_path[len("/vsizip/") :].split(
+                ".zip/", 1
+            )
+            with ZipFile(f"{zipfile_path}.zip") as zf:
+                with zf.open(member) as src, open(tmp_input_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, length=16 * 1024 * 1024)
+        else:
+            shutil.copyfile(input_path, tmp_input_path)
+
+    def process(self, input_path: Union[Path, str], output_path: Path):
         logger = self.get_logger()
 
         if self.overwrite_download and not self.overwrite_processing:
@@ -119,49 +374,224 @@ class ESALandcover:
 
         if output_path.exists() and not self.overwrite_processing:
             logger.info(f"Processed layer exists: {input_path}")
+            if self.write_histograms:
+                self.backfill_histograms(output_path)
 
         else:
             logger.info(f"Processing: {input_path}")
 
-            self.process_dir.mkdir(parents=True, exist_ok=True)
+            if self.use_tmp_copies:
+                self.process_dir.mkdir(parents=True, exist_ok=True)
 
-            tmp_input_path = self.process_dir / Path(input_path).name
-            tmp_output_path = self.process_dir / Path(output_path).name
+                tmp_input_path = self.process_dir / Path(input_path).name
+                tmp_output_path = self.process_dir / Path(output_path).name
 
-            logger.info(f"Copying input to tmp {input_path} {tmp_input_path}")
-            shutil.copyfile(input_path, tmp_input_path)
+                logger.info(
+                    f"Copying input to tmp {input_path} {tmp_input_path}"
+                )
+                self.copy_input(input_path, tmp_input_path)
+            else:
+                tmp_input_path = input_path
+                tmp_output_path = output_path
 
             logger.info(
                 f"Running raster calc {tmp_input_path} {tmp_output_path}"
             )
             netcdf_path = f"netcdf:{tmp_input_path}:lccs_class"
 
-            default_meta = {
-                "driver": "COG",
-                "compress": "LZW",
-                # 'count': 1,
-                # 'crs': {'init': 'epsg:4326'},
-                # 'nodata': -9999,
-            }
-
             with rasterio.open(netcdf_path) as src:
-                assert len(set(src.block_shapes)) == 1
                 meta = src.meta.copy()
-                meta.update(**default_meta)
-                with rasterio.open(tmp_output_path, "w", **meta) as dst:
-                    for ji, window in src.block_windows(1):
-                        in_data = src.read(window=window)
-                        out_data = self.map_func(in_data)
-                        out_data = out_data.astype(meta["dtype"])
-                        dst.write(out_data, window=window)
+                meta.update(**self.cog_profile)
+
+                if self.aoi_bounds:
+                    aoi_window = get_aoi_window(
+                        src.transform,
+                        src.width,
+                        src.height,
+                        self.aoi_bounds,
+                        buffer=self.aoi_buffer,
+                    )
+                    logger.info(f"Clipping to AOI window {aoi_window}")
+                    meta.update(
+                        width=aoi_window.width,
+                        height=aoi_window.height,
+                        transform=src.window_transform(aoi_window),
+                    )
+                else:
+                    aoi_window = Window(0, 0, src.width, src.height)
+
+                # read large windows of whole NetCDF chunks (or whole output
+                # tiles if a chunk does not fit the memory budget) rather
+                # than one native block at a time
+                windows = plan_windows(
+                    aoi_window,
+                    self.cog_profile["blocksize"],
+                    self.window_max_bytes,
+                    itemsize=np.dtype(meta["dtype"]).itemsize,
+                    native_shape=src.block_shapes[0],
+                )
+                logger.info(f"Processing {len(windows)} windows")
 
-            logger.info(
-                f"Copying output tmp to final {tmp_output_path} {output_path}"
+            histogram = (
+                BlockHistogram(
+                    meta["width"],
+                    meta["height"],
+                    block_size=self.cog_profile["blocksize"],
+                )
+                if self.write_histograms
+                else None
             )
-            shutil.copyfile(tmp_output_path, output_path)
+
+            with rasterio.open(tmp_output_path, "w", **meta) as dst:
+                for window, out_data in self.map_windows(netcdf_path, windows):
+                    out_data = out_data.astype(meta["dtype"], copy=False)
+                    # shift source windows to the origin of the output
+                    out_window = Window(
+                        window.col_off - aoi_window.col_off,
+                        window.row_off - aoi_window.row_off,
+                        window.width,
+                        window.height,
+                    )
+                    dst.write(out_data, window=out_window)
+                    if histogram is not None:
+                        histogram.add(out_window, out_data[0])
+
+            if self.use_tmp_copies:
+                logger.info(
+                    f"Copying output tmp to final {tmp_output_path} {output_path}"
+                )
+                shutil.copyfile(tmp_output_path, output_path)
+
+            # written after the output so that the sidecar is newer
+            if histogram is not None:
+                histogram.save(output_path)
 
         return
 
+    def backfill_histograms(self, raster_path: Path):
+        """
+        Write histogram sidecars for an existing output that has none (e.g.
+        processed before `write_histograms` was set), or whose sidecars are
+        older than the output
+        """
+        logger = self.get_logger()
+
+        with rasterio.open(raster_path) as src:
+            bands = [None] if src.count == 1 else list(src.indexes)
+
+        for band in bands:
+            if BlockHistogram.load(raster_path, band) is not None:
+                continue
+            logger.info(f"Writing histogram sidecar: {raster_path} {band}")
+            BlockHistogram.from_raster(
+                raster_path,
+                band=band or 1,
+                block_size=self.cog_profile["blocksize"],
+            ).save(raster_path, band)
+
+    def aggregate(self, year: int):
+        """
+        Build the fractional cover raster for a processed year, with the
+        fraction of each class per `fraction_factor` x `fraction_factor` cell
+        """
+        logger = self.get_logger()
+
+        input_path = self.output_dir / f"esa_lc_{year}.tif"
+        output_path = self.output_dir / f"esa_lc_fraction_{year}.tif"
+
+        if (
+            output_path.exists()
+            and not self.overwrite_processing
+            and output_path.stat().st_mtime >= input_path.stat().st_mtime
+        ):
+            logger.info(f"Fractional cover exists: {output_path}")
+            return
+
+        logger.info(f"Building fractional cover: {output_path}")
+        build_fractional_cover(
+            input_path,
+            output_path,
+            classes=self.fraction_classes,
+            factor=self.fraction_factor,
+            tile_size=self.cog_profile["blocksize"],
+            # fractions are continuous, so average them for overviews
+            profile={**self.cog_profile, "overview_resampling": "AVERAGE"},
+        )
+
+    def stack_is_current(self, year_paths: Dict[int, Path]) -> bool:
+        """
+        Check if the stack has the same years and is newer than every
+        processed raster
+        """
+        if not self.stack_path.exists():
+            return False
+        with rasterio.open(self.stack_path) as src:
+            if src.descriptions != tuple(str(i) for i in year_paths):
+                return False
+        stack_mtime = self.stack_path.stat().st_mtime
+        return all(
+            i.stat().st_mtime <= stack_mtime for i in year_paths.values()
+        )
+
+    def build_stack(self, year_paths: Dict[int, Path], stack_path: Path):
+        """
+        Combine the processed rasters for each year into a multi-band COG
+
+        Band `i` holds the i-th year, with the year as the band description.
+        The stack uses pixel interleaving, so a tile holds every year for
+        its pixels and a window can be read for all years in one I/O call.
+        With `write_histograms`, a sidecar is written for each band.
+
+        Args:
+            year_paths (Dict[int, Path]): Year mapped to its processed raster.
+                All rasters must share the same grid.
+            stack_path (Path): Path to write the stack to.
+        """
+        logger = self.get_logger()
+
+        logger.info(f"Building stack of {len(year_paths)} years: {stack_path}")
+
+        srcs = [rasterio.open(i) for i in year_paths.values()]
+        try:
+            grid = {(i.crs, i.transform, i.width, i.height) for i in srcs}
+            if len(grid) != 1:
+                raise ValueError("Rasters to stack do not share a grid")
+
+            meta = srcs[0].meta.copy()
+            meta.update(count=len(srcs))
+            windows = [window for ji, window in srcs[0].block_windows(1)]
+
+            histograms = (
+                [
+                    BlockHistogram(
+                        meta["width"],
+                        meta["height"],
+                        block_size=self.cog_profile["blocksize"],
+                    )
+                    for _ in srcs
+                ]
+                if self.write_histograms
+                else []
+            )
+
+            # written through a temporary GeoTIFF so the stack is not held
+            # in memory, both it and the COG interleave bands by pixel
+            with open_cog_writer(stack_path, meta, self.cog_profile) as dst:
+                for window in windows:
+                    for band, src in enumerate(srcs, start=1):
+                        data = src.read(1, window=window)
+                        dst.write(data, band, window=window)
+                        if histograms:
+                            histograms[band - 1].add(window, data)
+                dst.descriptions = tuple(str(i) for i in year_paths)
+        finally:
+            for src in srcs:
+                src.close()
+
+        # written after the stack so that the sidecars are newer
+        for band, histogram in enumerate(histograms, start=1):
+            histogram.save(stack_path, band)
+
     def main(self):
         """
         Main function to run the ESA land cover data download and processing
@@ -171,26 +601,96 @@ class ESALandcover:
         os.makedirs(self.raw_dir / "compressed", exist_ok=True)
         os.makedirs(self.raw_dir / "uncompressed", exist_ok=True)
 
-        # Download data
-        logger.info("Running data download")
-
-        download_results = []
-        for year in self.years:
-            download = self.download(year)
-            download_results.append(download)
-
         os.makedirs(self.output_dir, exist_ok=True)
 
-        # Process data
-        logger.info("Running processing")
+        # downloads run in worker threads (the producers) while the main
+        # thread processes each year as soon as its download is complete
+        # (the consumer), at most queue_depth years are downloading or
+        # waiting to be processed at a time
+        logger.info("Running data download and processing")
 
-        process_inputs = zip(
-            download_results,
-            [self.output_dir / f"esa_lc_{year}.tif" for year in self.years],
-        )
-
-        for pi in process_inputs:
-            _ = self.process(*pi)
+        # years that are already processed are not downloaded again, which
+        # matters when downloads are not kept
+        download_years = []
+        for year in self.years:
+            output_path = self.output_dir / f"esa_lc_{year}.tif"
+            if (
+                output_path.exists()
+                and not self.overwrite_processing
+                and not self.overwrite_download
+            ):
+                logger.info(f"Processed layer exists: {output_path}")
+                if self.write_histograms:
+                    self.backfill_histograms(output_path)
+                if self.fraction_factor:
+                    self.aggregate(year)
+            else:
+                download_years.append(year)
+
+        queue_depth = self.queue_depth or len(download_years)
+        pending_years = iter(download_years)
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+
+            def submit_next():
+                year = next(pending_years, None)
+                if year is not None:
+                    futures[executor.submit(self.download, year)] = year
+
+            for _ in range(queue_depth):
+                submit_next()
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    year = futures.pop(future)
+                    input_path = future.result()
+                    self.process(
+                        input_path, self.output_dir / f"esa_lc_{year}.tif"
+                    )
+                    if self.fraction_factor:
+                        self.aggregate(year)
+                    if not self.keep_downloads:
+                        self.remove_download(year, input_path)
+                    submit_next()
+
+        if self.output_stack:
+            year_paths = {
+                year: self.output_dir / f"esa_lc_{year}.tif"
+                for year in self.years
+            }
+            if self.overwrite_processing or not self.stack_is_current(
+                year_paths
+            ):
+                self.build_stack(year_paths, self.stack_path)
+            else:
+                logger.info(f"Stack exists: {self.stack_path}")
+                if self.write_histograms:
+                    self.backfill_histograms(self.stack_path)
+
+        if self.transition_paths:
+            year_paths = {
+                year: self.output_dir / f"esa_lc_{year}.tif"
+                for year in self.years
+            }
+            # rebuild the transitions if any are missing or older than the
+            # years they are computed from
+            stale = self.overwrite_processing or any(
+                not path.exists()
+                or path.stat().st_mtime
+                < max(year_paths[i].stat().st_mtime for i in pair)
+                for pair, path in self.transition_paths.items()
+            )
+            if stale:
+                logger.info(
+                    f"Building transition rasters: {list(self.transition_paths)}"
+                )
+                build_transition_rasters(
+                    year_paths, self.transition_paths, profile=self.cog_profile
+                )
+            else:
+                logger.info("Transition rasters exist")
 
         logging.info("Finished processing land cover data")
 
@@ -198,6 +698,15 @@ class ESALandcover:
 if __name__ == "__main__":
     config = get_config()
     base_path = Path(config["base_path"])
+
+    aoi_bounds = get_aoi_bounds(
+        bbox=config["landcover"].get("aoi_bbox"),
+        meta_paths=[
+            base_path / i
+            for i in config["landcover"].get("aoi_meta_paths", [])
+        ],
+    )
+
     lc_config = {
         "raw_dir": base_path / config["landcover"]["dataset_name"] / "tmp/raw",
         "process_dir": base_path
@@ -207,8 +716,28 @@ if __name__ == "__main__":
         "years": config["landcover"]["years"],
         "api_key": os.environ[config["landcover"]["api_key_env_var"]],
         "overwrite_download": config["landcover"]["overwrite_download"],
-        "overwrite_processing": config["landcover"]["overwrite_processing"],
+        # reprocess existing outputs when run by the pipeline after a config
+        # change
+        "overwrite_processing": config["landcover"]["overwrite_processing"]
+        or overwrite_requested(),
         "mapping": config["landcover"]["mapping"],
+        "mapping_default": config["landcover"].get("mapping_default", 0),
+        "max_workers": config["landcover"].get("max_workers"),
+        "pool_type": config["landcover"].get("pool_type", "process"),
+        "extract_netcdf": config["landcover"].get("extract_netcdf", True),
+        "use_tmp_copies": config["landcover"].get("use_tmp_copies", False),
+        "aoi_bounds": aoi_bounds,
+        "aoi_buffer": config["landcover"].get("aoi_buffer", 0),
+        "download_workers": config["landcover"].get("download_workers", 1),
+        "queue_depth": config["landcover"].get("queue_depth", 0),
+        "keep_downloads": config["landcover"].get("keep_downloads", True),
+        "output_stack": config["landcover"].get("output_stack", False),
+        "transitions": config["landcover"].get("transitions"),
+        "fraction_factor": config["landcover"].get("fraction_factor", 0),
+        "category_map": config["landcover"]["category_map"],
+        "write_histograms": config["landcover"].get("write_histograms", False),
+        "cog_options": config["landcover"].get("cog"),
+        "window_memory_mb": config["landcover"].get("window_memory_mb", 32),
     }
 
     lc_config["output_dir"].mkdir(parents=True, exist_ok=True)
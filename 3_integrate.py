@@ -3,14 +3,23 @@ Integrate datasets previously downloaded and processed into a format ready for a
 """
 
 import logging
-from functools import reduce
 from pathlib import Path
 
 import geopandas as gpd
 import pandas as pd
-import rasterstats as rs
+import rasterio
 
+from catalog import BoundaryCatalog
 from config import get_config
+from indicators import calculate_indicators
+from landcover_products import transition_table
+from vector_utils import (
+    FORMAT_EXTENSIONS,
+    assign_largest_overlap,
+    read_boundary,
+    write_boundary,
+)
+from zonal import CategoricalZonalStats
 
 config = get_config()
 
@@ -31,21 +40,49 @@ base_path = Path(config["base_path"])
 
 treatment_path = base_path / config["treatment_path"]
 
-adm2_path = (
+boundary_dir = (
     base_path
     / "geoBoundaries"
     / f'{config["boundary"]["version"]}_{config["boundary"]["gb_data_hash"]}_{config["boundary"]["gb_web_hash"]}'
-    / "geoBoundaries-GHA-ADM2"
-    / "geoBoundaries-GHA-ADM2.geojson"
 )
 
-adm1_path = (
-    base_path
-    / "geoBoundaries"
-    / f'{config["boundary"]["version"]}_{config["boundary"]["gb_data_hash"]}_{config["boundary"]["gb_web_hash"]}'
-    / "geoBoundaries-GHA-ADM1"
-    / "geoBoundaries-GHA-ADM1.geojson"
-)
+# look up the boundaries in the catalog of the release
+# (built from the boundary metadata files if the catalog is missing)
+boundary_catalog = BoundaryCatalog(boundary_dir / "catalog.sqlite")
+if boundary_catalog.count() == 0:
+    boundary_catalog.rebuild(boundary_dir)
+
+boundary_ext = FORMAT_EXTENSIONS[config["integrate"]["boundary_format"]]
+
+adm2_meta = boundary_catalog.get("GHA", 2)
+adm1_meta = boundary_catalog.get("GHA", 1)
+
+for level, meta in ((2, adm2_meta), (1, adm1_meta)):
+    if meta is None:
+        raise FileNotFoundError(
+            f"GHA ADM{level} boundary not found in the catalog of "
+            f"{boundary_dir}, check that it was downloaded by 1_boundary.py"
+        )
+
+adm2_path = Path(adm2_meta["path"]).with_suffix(boundary_ext)
+adm1_path = Path(adm1_meta["path"]).with_suffix(boundary_ext)
+
+# simplified boundaries used to find likely adm1 matches before computing
+# full resolution overlaps, if they were written for this tolerance
+overlap_tolerance = f'{config["integrate"]["overlap_tolerance"]:g}'
+if (
+    config["integrate"]["overlap_tolerance"]
+    and overlap_tolerance in adm2_meta.get("simplified", {})
+    and overlap_tolerance in adm1_meta.get("simplified", {})
+):
+    coarse_adm2_path = Path(
+        adm2_meta["simplified"][overlap_tolerance]
+    ).with_suffix(boundary_ext)
+    coarse_adm1_path = Path(
+        adm1_meta["simplified"][overlap_tolerance]
+    ).with_suffix(boundary_ext)
+else:
+    coarse_adm2_path = coarse_adm1_path = None
 
 
 raster_items = {
@@ -53,9 +90,25 @@ raster_items = {
     for year in config["landcover"]["years"]
 }
 
+# use the multi-band stack of all years if it was built, so each window is
+# read once for all years (bands are matched to years by description)
+stack_path = base_path / "esa_landcover" / "esa_lc_stack.tif"
+if config["landcover"].get("output_stack") and stack_path.exists():
+    with rasterio.open(stack_path) as src:
+        stack_bands = {
+            int(year): band
+            for band, year in enumerate(src.descriptions, start=1)
+        }
+    raster_items = {
+        f"esa_lc_{year}": (stack_path, stack_bands[year])
+        for year in config["landcover"]["years"]
+    }
+
 
 output_csv_path = base_path / "output" / "ghana_adm2_data.csv"
 output_geojson_path = base_path / "output" / "ghana_adm2_data.geojson"
+output_parquet_path = base_path / "output" / "ghana_adm2_data.parquet"
+output_transitions_path = base_path / "output" / "ghana_adm2_transitions.csv"
 
 
 # -------------------------------------
@@ -63,48 +116,48 @@ output_geojson_path = base_path / "output" / "ghana_adm2_data.geojson"
 
 logger.info("Preparing boundary data")
 
-# load adm2 and adm1 data
-adm2_gdf = gpd.GeoDataFrame.from_file(adm2_path)
-adm1_gdf = gpd.GeoDataFrame.from_file(adm1_path)
+# load adm2 and adm1 data, only reading the columns we need
+# (and only features within the bounding box, if one is set)
+boundary_columns = ["shapeName", "shapeID"]
+boundary_bbox = config["integrate"]["boundary_bbox"] or None
 
-# drop unnecessary columns
-adm2_gdf = adm2_gdf.drop(columns=["shapeISO", "shapeGroup", "shapeType"])
-adm1_gdf = adm1_gdf.drop(columns=["shapeISO", "shapeGroup", "shapeType"])
-
-# spatially join the adm1 to the adm2 data
-# this will produce rows for every intersection between an adm2 and adm1 polygon
-# meaning there will be multiple rows for each adm2 polygon
-adm2_gdf = adm2_gdf.sjoin(
-    adm1_gdf,
-    how="inner",
-    predicate="intersects",
-    lsuffix="adm2",
-    rsuffix="adm1",
+adm2_gdf = read_boundary(
+    adm2_path, columns=boundary_columns, bbox=boundary_bbox
 )
-
-# merge the adm1 geometry into the adm2 data that now has the associated adm1 id
-adm2_gdf = adm2_gdf.merge(
-    adm1_gdf[["shapeID", "geometry"]],
-    how="left",
-    left_on="shapeID_adm1",
-    right_on="shapeID",
-    suffixes=("", "_adm1"),
+adm1_gdf = read_boundary(
+    adm1_path, columns=boundary_columns, bbox=boundary_bbox
 )
 
-# drop unnecessary columns from the joins
-adm2_gdf = adm2_gdf.drop(columns=["index_adm1", "shapeID"])
-
-# calculate the overlap between all adm2 and adm1 intersections found by the spatial join
-adm2_gdf["overlap_adm1"] = adm2_gdf.apply(
-    lambda x: x.geometry.intersection(x.geometry_adm1).area / x.geometry.area,
-    axis=1,
+# find the adm1 polygon that each adm2 polygon overlaps the most
+# this should give us the most accurate adm1 polygon for each adm2 polygon since the boundaries are not perfect
+# adm2 polygons that do not intersect any adm1 polygon are dropped
+# the simplified boundaries are matched to the full resolution ones by shapeID
+coarse_geoms = {}
+if coarse_adm2_path is not None:
+    for name, path, gdf in [
+        ("adm2", coarse_adm2_path, adm2_gdf),
+        ("adm1", coarse_adm1_path, adm1_gdf),
+    ]:
+        coarse_gdf = read_boundary(
+            path, columns=["shapeID"], bbox=boundary_bbox
+        ).drop_duplicates("shapeID")
+        coarse_geoms[name] = gpd.GeoSeries(
+            coarse_gdf.geometry.values, index=coarse_gdf.shapeID.values
+        ).reindex(gdf.shapeID.values)
+        coarse_geoms[name].index = gdf.index
+
+adm1_match = assign_largest_overlap(
+    adm2_gdf,
+    adm1_gdf,
+    parent_fields=["shapeName", "shapeID"],
+    coarse_children=coarse_geoms.get("adm2"),
+    coarse_parents=coarse_geoms.get("adm1"),
 )
 
-# keep only instance of shapeID_adm2 with the largest overlap_adm1
-# this should give us the most accurate adm1 polygon for each adm2 polygon since the boundaries are not perfect
-adm2_gdf = adm2_gdf.loc[
-    adm2_gdf.groupby("shapeID_adm2")["overlap_adm1"].idxmax()
-]
+adm2_gdf = adm2_gdf.rename(
+    columns={"shapeName": "shapeName_adm2", "shapeID": "shapeID_adm2"}
+)
+adm2_gdf = adm2_gdf.join(adm1_match.add_suffix("_adm1"), how="inner")
 
 # confirm that we do not have any overlaps that are very small
 assert (
@@ -144,45 +197,32 @@ id_field = "shapeID_adm2"
 category_map = config["landcover"]["category_map"]
 category_map = {v: k for k, v in category_map.items()}
 
-# init results list with the existing adm2 gdf
-# this will be used to merge the results of the zonal stats
-# the zonal stats gdfs will drop the base columns so that they are not duplicated
-results = [adm2_gdf]
-
-# loop through the rasters and calculate zonal stats for each
-# fill na values with 0
-# append each resulting gdf to the results list
-for raster_id, raster_path in raster_items.items():
-    tmp_stats = rs.zonal_stats(
-        adm2_gdf,
-        raster_path,
-        geojson_out=True,
-        prefix=f"{raster_id}_",
-        categorical=True,
+# rasterize the adm2 polygons once and count the land cover classes within
+# each polygon for every year of land cover data
+# this produces a table with one row per adm2 polygon and one column per
+# year and land cover class (e.g. esa_lc_2015_forest)
+zonal_stats = CategoricalZonalStats(adm2_gdf, id_field, all_touched=True)
+stats_df = zonal_stats.to_frame(raster_items, category_map=category_map)
+
+# count the land cover transitions between pairs of years within each adm2
+# polygon, with one row per polygon and transition that occurs in it
+transition_tables = []
+for from_year, to_year in config["landcover"].get("transitions", []):
+    tmp_df = transition_table(
+        zonal_stats,
+        base_path
+        / "esa_landcover"
+        / f"esa_lc_transition_{from_year}_{to_year}.tif",
         category_map=category_map,
-        all_touched=True,
     )
-    tmp_gdf = gpd.GeoDataFrame.from_features(tmp_stats)
-    tmp_gdf = tmp_gdf.fillna(0)
-    tmp_cols = tmp_gdf.columns
-    # drop columns except the id field and the raster stats to avoid duplicates
-    tmp_gdf = tmp_gdf[
-        [
-            i
-            for i in tmp_gdf.columns
-            if i not in results[0].columns or i == id_field
-        ]
-    ]
-    results.append(tmp_gdf)
-
-
-# merge results into single gdf
-stats_gdf = reduce(
-    lambda left, right: pd.merge(left, right, on=id_field, how="inner"), results
-)
+    tmp_df.insert(1, "from_year", from_year)
+    tmp_df.insert(2, "to_year", to_year)
+    transition_tables.append(tmp_df)
 
-# drop the adm1 geometry column
-stats_gdf = stats_gdf.drop(columns=["geometry_adm1"])
+# merge the zonal stats results into the adm2 gdf
+stats_gdf = adm2_gdf.merge(
+    stats_df, how="inner", left_on=id_field, right_index=True
+)
 
 
 # ---------------------------------------
@@ -190,69 +230,14 @@ stats_gdf = stats_gdf.drop(columns=["geometry_adm1"])
 
 logger.info("Performing calculations")
 
-calc_gdf = stats_gdf.copy()
-
-calc_gdf["lc_2015_count"] = calc_gdf.apply(
-    lambda x: sum([x[i] for i in x.keys() if "esa_lc_2015_" in i]), axis=1
-)
-calc_gdf["lc_2020_count"] = calc_gdf.apply(
-    lambda x: sum([x[i] for i in x.keys() if "esa_lc_2020_" in i]), axis=1
-)
-
-calc_gdf["lc_2015_count_land"] = calc_gdf.apply(
-    lambda x: sum(
-        [x[i] for i in x.keys() if "esa_lc_2015_" in i and "water" not in i]
-    ),
-    axis=1,
-)
-calc_gdf["lc_2020_count_land"] = calc_gdf.apply(
-    lambda x: sum(
-        [x[i] for i in x.keys() if "esa_lc_2020_" in i and "water" not in i]
-    ),
-    axis=1,
-)
-
-calc_gdf["lc_2015_count_cropland"] = calc_gdf.apply(
-    lambda x: sum(
-        [x[i] for i in x.keys() if "esa_lc_2015_" in i and "cropland" in i]
-    ),
-    axis=1,
-)
-calc_gdf["lc_2020_count_cropland"] = calc_gdf.apply(
-    lambda x: sum(
-        [x[i] for i in x.keys() if "esa_lc_2020_" in i and "cropland" in i]
-    ),
-    axis=1,
-)
-
-calc_gdf["lc_2015_percent_forest"] = (
-    calc_gdf["esa_lc_2015_forest"] / calc_gdf["lc_2015_count_land"] * 100
-)
-calc_gdf["lc_2015_percent_urban"] = (
-    calc_gdf["esa_lc_2015_urban"] / calc_gdf["lc_2015_count_land"] * 100
-)
-calc_gdf["lc_2015_percent_cropland"] = (
-    calc_gdf["lc_2015_count_cropland"] / calc_gdf["lc_2015_count_land"] * 100
-)
-
-calc_gdf["lc_2020_percent_forest"] = (
-    calc_gdf["esa_lc_2020_forest"] / calc_gdf["lc_2020_count_land"] * 100
-)
-calc_gdf["lc_2020_percent_urban"] = (
-    calc_gdf["esa_lc_2020_urban"] / calc_gdf["lc_2020_count_land"] * 100
-)
-calc_gdf["lc_2020_percent_cropland"] = (
-    calc_gdf["lc_2020_count_cropland"] / calc_gdf["lc_2020_count_land"] * 100
-)
-
-calc_gdf["forest_change"] = (
-    calc_gdf["lc_2020_percent_forest"] - calc_gdf["lc_2015_percent_forest"]
-)
-calc_gdf["urban_change"] = (
-    calc_gdf["lc_2020_percent_urban"] - calc_gdf["lc_2015_percent_urban"]
-)
-calc_gdf["cropland_change"] = (
-    calc_gdf["lc_2020_percent_cropland"] - calc_gdf["lc_2015_percent_cropland"]
+# calculate the land cover count, percent and change indicators defined in
+# the indicators section of the config for every year of land cover data
+calc_gdf = calculate_indicators(
+    stats_gdf,
+    years=config["landcover"]["years"],
+    class_names=config["landcover"]["category_map"].keys(),
+    spec=config["indicators"],
+    prefix="esa_lc",
 )
 
 
@@ -264,10 +249,24 @@ logger.info("Exporting results")
 # make sure the output directory exists
 output_csv_path.parent.mkdir(parents=True, exist_ok=True)
 
+output_formats = config["integrate"]["output_formats"]
+
 # write output to csv
-calc_gdf[[i for i in calc_gdf.columns if i != "geometry"]].to_csv(
-    output_csv_path, index=False, encoding="utf-8"
-)
+if "csv" in output_formats:
+    calc_gdf[[i for i in calc_gdf.columns if i != "geometry"]].to_csv(
+        output_csv_path, index=False, encoding="utf-8"
+    )
 
 # write output to geojson
-calc_gdf.to_file(output_geojson_path, driver="GeoJSON", encoding="utf-8")
+if "geojson" in output_formats:
+    calc_gdf.to_file(output_geojson_path, driver="GeoJSON", encoding="utf-8")
+
+# write output to geoparquet
+if "parquet" in output_formats:
+    write_boundary(calc_gdf, output_parquet_path)
+
+# write land cover transitions to csv
+if transition_tables:
+    pd.concat(transition_tables).to_csv(
+        output_transitions_path, index=False, encoding="utf-8"
+    )
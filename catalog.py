@@ -0,0 +1,178 @@
+"""
+Catalog of downloaded boundaries built from their .meta.json files
+"""
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+import shapely
+
+
+class BoundaryCatalog:
+    """
+    SQLite catalog of the boundaries in a release directory
+
+    Each boundary's metadata is indexed by ISO3 code and ADM level, with an
+    R-tree over its `spatial_extent` for bounding box queries. The catalog is
+    updated as boundaries are written, so finding a boundary does not
+    require scanning the release directory.
+    """
+
+    def __init__(self, db_path: Union[Path, str]):
+        """
+        Args:
+            db_path (Union[Path, str]): Path to the SQLite database, created if
+                it does not exist.
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS boundaries (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL,
+                    iso3 TEXT NOT NULL,
+                    level INTEGER NOT NULL,
+                    path TEXT,
+                    meta_path TEXT NOT NULL,
+                    meta TEXT NOT NULL,
+                    UNIQUE (iso3, level)
+                )
+                """)
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS boundaries_rtree
+                USING rtree(id, minx, maxx, miny, maxy)
+                """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open a connection that commits on success and is always closed
+        """
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, meta: dict, meta_path: Union[Path, str]):
+        """
+        Add or update a boundary in the catalog
+
+        Args:
+            meta (dict): Boundary metadata, as written to its .meta.json.
+            meta_path (Union[Path, str]): Path to the .meta.json file.
+        """
+        minx, miny, maxx, maxy = shapely.from_wkt(
+            meta["spatial_extent"]
+        ).bounds
+
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM boundaries WHERE name = ?", (meta["name"],)
+            ).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM boundaries WHERE id = ?", row)
+                conn.execute("DELETE FROM boundaries_rtree WHERE id = ?", row)
+
+            cursor = conn.execute(
+                """
+                INSERT INTO boundaries
+                (name, iso3, level, path, meta_path, meta)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    meta["name"],
+                    meta["other"]["boundaryISO"],
+                    meta["group_level"],
+                    meta["path"],
+                    str(meta_path),
+                    json.dumps(meta),
+                ),
+            )
+            conn.execute(
+                "INSERT INTO boundaries_rtree VALUES (?, ?, ?, ?, ?)",
+                (cursor.lastrowid, minx, maxx, miny, maxy),
+            )
+
+    def add_from_file(self, meta_path: Union[Path, str]):
+        """
+        Add or update a boundary in the catalog from its .meta.json file
+        """
+        with open(meta_path, "r") as src:
+            self.add(json.load(src), meta_path)
+
+    def rebuild(self, release_dir: Union[Path, str]):
+        """
+        Add every boundary in a release directory to the catalog
+
+        Args:
+            release_dir (Union[Path, str]): Release directory containing a
+                directory with a .meta.json file for each boundary.
+        """
+        for meta_path in sorted(Path(release_dir).glob("*/*.meta.json")):
+            self.add_from_file(meta_path)
+
+    def count(self) -> int:
+        """Number of boundaries in the catalog"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM boundaries").fetchone()[
+                0
+            ]
+
+    def get(self, iso3: str, level: int) -> Optional[dict]:
+        """
+        Get the metadata of a boundary
+
+        Args:
+            iso3 (str): ISO3 code of the boundary.
+            level (int): ADM level of the boundary.
+
+        Returns:
+            dict: The boundary metadata, or None if it is not in the catalog.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT meta FROM boundaries WHERE iso3 = ? AND level = ?",
+                (iso3, level),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def intersecting(
+        self,
+        bbox: Tuple[float, float, float, float],
+        level: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        Find boundaries whose spatial extent intersects a bounding box
+
+        Args:
+            bbox (Tuple[float, float, float, float]): Bounding box as
+                (minx, miny, maxx, maxy).
+            level (int): Only return boundaries of this ADM level.
+
+        Returns:
+            List[dict]: Metadata of the matching boundaries.
+        """
+        minx, miny, maxx, maxy = bbox
+        query = """
+            SELECT b.meta FROM boundaries_rtree r
+            JOIN boundaries b ON b.id = r.id
+            WHERE r.minx <= ? AND r.maxx >= ? AND r.miny <= ? AND r.maxy >= ?
+        """
+        params = [maxx, minx, maxy, miny]
+        if level is not None:
+            query += " AND b.level = ?"
+            params.append(level)
+
+        with self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY b.name", params).fetchall()
+        return [json.loads(i[0]) for i in rows]
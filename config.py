@@ -1,8 +1,13 @@
+import os
 from pathlib import Path
 from typing import Union
 
 import tomllib
 
+# set by pipeline.py when a stage is run again because its config changed,
+# so the scripts replace existing outputs rather than skipping them
+OVERWRITE_ENV_VAR = "PIPELINE_OVERWRITE"
+
 
 def get_config(config_path: Union[Path, str] = "config.toml"):
     """
@@ -20,3 +25,13 @@ def get_config(config_path: Union[Path, str] = "config.toml"):
             return tomllib.load(src)
     else:
         return FileNotFoundError("No TOML config file found for dataset.")
+
+
+def overwrite_requested() -> bool:
+    """
+    Check if the pipeline requested that existing outputs are replaced
+
+    Returns:
+        bool: True if the OVERWRITE_ENV_VAR environment variable is set.
+    """
+    return os.environ.get(OVERWRITE_ENV_VAR) == "1"
@@ -0,0 +1,172 @@
+"""
+Content-addressed cache for downloaded files
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+from http_utils import download_file
+
+# matches commit-pinned GitHub URLs such as
+# https://github.com/wmgeolab/geoBoundaries/raw/c0ed7b8/releaseData/...
+PINNED_URL_PATTERN = re.compile(r"/(?:raw|blob)/([0-9a-f]{7,40})/")
+
+
+class DownloadCache:
+    """
+    Cache of downloaded files stored by the SHA-256 hash of their content
+
+    Files are stored once under `blobs/` no matter how many URLs or release
+    directories refer to them. Commit-pinned URLs point at immutable content,
+    so the URL to content hash mapping is also stored under `urls/` and
+    repeat requests for those URLs are served without any network access.
+
+    The cache is limited to `max_size` bytes by `evict`, which removes the
+    least recently used files first. It is not run when files are added, as
+    files returned to other threads could be removed while in use, so call
+    it once all downloads have finished.
+    """
+
+    def __init__(self, cache_dir: Union[Path, str], max_size: int):
+        """
+        Args:
+            cache_dir (Union[Path, str]): Directory to store the cache in.
+            max_size (int): Maximum total size of cached files in bytes.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.blob_dir = self.cache_dir / "blobs"
+        self.url_dir = self.cache_dir / "urls"
+        self.tmp_dir = self.cache_dir / "tmp"
+        for i in (self.blob_dir, self.url_dir, self.tmp_dir):
+            i.mkdir(parents=True, exist_ok=True)
+
+        self.max_size = max_size
+        self._evict_lock = threading.Lock()
+
+    def get_logger(self):
+        """
+        Retrieve and return the base logger to be used for the cache
+        """
+        return logging.getLogger("boundary")
+
+    @staticmethod
+    def is_pinned(url: str) -> bool:
+        """Check if a URL refers to a fixed commit"""
+        return PINNED_URL_PATTERN.search(url) is not None
+
+    def _url_path(self, url: str) -> Path:
+        return self.url_dir / hashlib.sha256(url.encode()).hexdigest()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / digest
+
+    def get(self, url: str) -> Optional[Path]:
+        """
+        Get the cached file for a commit-pinned URL
+
+        Args:
+            url (str): URL of the file.
+
+        Returns:
+            Path: Path to the cached file, or None if it is not cached.
+        """
+        url_path = self._url_path(url)
+        if not url_path.exists():
+            return None
+
+        blob_path = self._blob_path(url_path.read_text().strip())
+        if not blob_path.exists():
+            return None
+
+        # update the access time used for eviction
+        os.utime(blob_path)
+        return blob_path
+
+    def put(self, url: str, src_path: Union[Path, str], digest: str) -> Path:
+        """
+        Move a downloaded file into the cache
+
+        Args:
+            url (str): URL the file was downloaded from.
+            src_path (Union[Path, str]): Path to the downloaded file. The file
+                is moved, so it should be on the same filesystem as the cache.
+            digest (str): SHA-256 hex digest of the file content.
+
+        Returns:
+            Path: Path to the cached file.
+        """
+        blob_path = self._blob_path(digest)
+        blob_path.parent.mkdir(exist_ok=True)
+        if blob_path.exists():
+            os.remove(src_path)
+            os.utime(blob_path)
+        else:
+            os.replace(src_path, blob_path)
+
+        if self.is_pinned(url):
+            url_path = self._url_path(url)
+            tmp_url_path = url_path.with_suffix(f".{threading.get_ident()}")
+            tmp_url_path.write_text(digest)
+            os.replace(tmp_url_path, url_path)
+
+        return blob_path
+
+    def fetch(self, url: str, chunk_size: int = 1024 * 1024) -> Path:
+        """
+        Get a file from the cache, downloading it if needed
+
+        Downloads are streamed to disk in chunks while being hashed.
+
+        Args:
+            url (str): URL of the file.
+            chunk_size (int): Size in bytes of each chunk streamed to disk.
+
+        Returns:
+            Path: Path to the cached file.
+
+        Raises:
+            requests.HTTPError: If the download fails.
+        """
+        logger = self.get_logger()
+
+        cached_path = self.get(url)
+        if cached_path is not None:
+            logger.debug(f"Cache hit: {url}")
+            return cached_path
+
+        logger.debug(f"Cache miss: {url}")
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        try:
+            digest = download_file(url, tmp_path, chunk_size=chunk_size)
+        except:
+            os.remove(tmp_path)
+            raise
+
+        return self.put(url, tmp_path, digest)
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache fits within its
+        maximum size
+        """
+        logger = self.get_logger()
+
+        with self._evict_lock:
+            blobs = [(i, i.stat()) for i in self.blob_dir.glob("*/*")]
+            total_size = sum(stat.st_size for _, stat in blobs)
+            if total_size <= self.max_size:
+                return
+
+            for blob_path, stat in sorted(blobs, key=lambda x: x[1].st_mtime):
+                if total_size <= self.max_size:
+                    break
+                logger.info(f"Evicting cached file: {blob_path.name}")
+                blob_path.unlink(missing_ok=True)
+                total_size -= stat.st_size
@@ -0,0 +1,96 @@
+"""
+Example benchmark of COG output profiles for categorical land cover data
+
+Writes the same raster with each profile and reports the write time, file
+size and the time to read it back (as a full read and as random windows).
+
+Run with the path to a processed land cover raster, e.g.
+`uv run examples/cog_benchmark.py data/esa_landcover/esa_lc_2015.tif`
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from raster_utils import get_cog_profile
+
+input_path = Path(sys.argv[1])
+
+profiles = {
+    "lzw": get_cog_profile(compress="LZW"),
+    "lzw_threads": get_cog_profile(compress="LZW", num_threads="ALL_CPUS"),
+    "deflate_6": get_cog_profile(
+        compress="DEFLATE", level=6, num_threads="ALL_CPUS"
+    ),
+    "deflate_6_predictor": get_cog_profile(
+        compress="DEFLATE", level=6, predictor=2, num_threads="ALL_CPUS"
+    ),
+    "zstd_1": get_cog_profile(
+        compress="ZSTD", level=1, num_threads="ALL_CPUS"
+    ),
+    "zstd_9": get_cog_profile(
+        compress="ZSTD", level=9, num_threads="ALL_CPUS"
+    ),
+    "zstd_9_256": get_cog_profile(
+        compress="ZSTD", level=9, blocksize=256, num_threads="ALL_CPUS"
+    ),
+    "zstd_9_no_overviews": get_cog_profile(
+        compress="ZSTD", level=9, overviews="NONE", num_threads="ALL_CPUS"
+    ),
+}
+
+# number of random 512 x 512 windows read from each output
+n_windows = 200
+
+with rasterio.open(input_path) as src:
+    meta = src.meta.copy()
+    data = src.read(1)
+
+rng = np.random.default_rng(0)
+window_offsets = rng.integers(
+    0,
+    [max(1, meta["height"] - 512), max(1, meta["width"] - 512)],
+    size=(n_windows, 2),
+)
+
+print(f"Input: {input_path} ({meta['width']} x {meta['height']})")
+print(
+    f"{'profile':<22}{'write (s)':>10}{'size (MB)':>11}"
+    f"{'read (s)':>10}{'windows (s)':>13}"
+)
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for name, profile in profiles.items():
+        output_path = Path(tmp_dir) / f"{name}.tif"
+
+        write_start_time = time.time()
+        out_meta = meta.copy()
+        out_meta.update(**profile)
+        with rasterio.open(output_path, "w", **out_meta) as dst:
+            dst.write(data, 1)
+        write_time = time.time() - write_start_time
+
+        size = output_path.stat().st_size / 1024**2
+
+        read_start_time = time.time()
+        with rasterio.open(output_path) as src:
+            assert (src.read(1) == data).all()
+        read_time = time.time() - read_start_time
+
+        window_start_time = time.time()
+        with rasterio.open(output_path) as src:
+            for row, col in window_offsets:
+                src.read(1, window=Window(col, row, 512, 512))
+        window_time = time.time() - window_start_time
+
+        print(
+            f"{name:<22}{write_time:>10.2f}{size:>11.2f}"
+            f"{read_time:>10.2f}{window_time:>13.2f}"
+        )
@@ -0,0 +1,201 @@
+"""
+HTTP helpers using a shared session with connection pooling, retries and
+timeouts
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (10, 120)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(
+    pool_size: int = 32,
+    total_retries: int = 5,
+    backoff_factor: float = 0.5,
+    backoff_jitter: float = 0.5,
+) -> requests.Session:
+    """
+    Create a session that keeps connections alive and retries failed requests
+
+    Retries use exponential backoff with random jitter and apply to connection
+    errors and transient server responses (429 and 5xx). The final response is
+    returned rather than raised so callers can check the status code.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections per host. Should
+            be at least the number of threads sharing the session.
+        total_retries (int): Maximum number of retries per request.
+        backoff_factor (float): Base delay in seconds, doubled on each retry.
+        backoff_jitter (float): Maximum random delay in seconds added to each
+            backoff.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    retry = Retry(
+        total=total_retries,
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_jitter,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Get the session shared by all requests in this process
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def http_get(
+    url: str,
+    session: Optional[requests.Session] = None,
+    timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+    **kwargs,
+) -> requests.Response:
+    """
+    Send a GET request using the shared session
+
+    Args:
+        url (str): URL to request.
+        session (requests.Session): Session to use instead of the shared one.
+        timeout (Tuple[float, float]): Connect and read timeouts in seconds.
+        **kwargs: Additional arguments passed to `requests.Session.get`.
+
+    Returns:
+        requests.Response: The response.
+    """
+    session = session or get_session()
+    return session.get(url, timeout=timeout, **kwargs)
+
+
+def download_file(
+    url: str, dst_path: Union[Path, str], chunk_size: int = 1024 * 1024
+) -> str:
+    """
+    Stream a download to a file in chunks
+
+    Args:
+        url (str): URL to download.
+        dst_path (Union[Path, str]): Path to write the file to.
+        chunk_size (int): Size in bytes of each chunk written.
+
+    Returns:
+        str: SHA-256 hex digest of the downloaded content.
+
+    Raises:
+        requests.HTTPError: If the download fails.
+    """
+    sha256 = hashlib.sha256()
+    with http_get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(dst_path, "wb") as dst:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                sha256.update(chunk)
+                dst.write(chunk)
+    return sha256.hexdigest()
+
+
+def get_json_cached(
+    url: str, cache_path: Union[Path, str], immutable: bool = False
+) -> Any:
+    """
+    Get JSON content from a URL, keeping a local copy that is revalidated
+    with conditional requests
+
+    The response's ETag and Last-Modified headers are stored next to the
+    cached copy and sent back as If-None-Match / If-Modified-Since, so an
+    unchanged resource costs a single 304 response. Immutable resources (e.g.
+    URLs pinned to a commit) are served from the local copy without any
+    request. If the request fails, the local copy is used when available.
+
+    Args:
+        url (str): URL of the JSON resource.
+        cache_path (Union[Path, str]): Path to store the local copy at.
+        immutable (bool): Whether the content of the URL can never change.
+
+    Returns:
+        Any: The parsed JSON content.
+    """
+    logger = logging.getLogger("http")
+
+    cache_path = Path(cache_path)
+    headers_path = cache_path.with_name(f"{cache_path.name}.headers")
+
+    if cache_path.exists() and immutable:
+        logger.info(f"Using pinned local copy of {url}")
+        with open(cache_path, "rb") as src:
+            return json.load(src)
+
+    request_headers = {}
+    if cache_path.exists() and headers_path.exists():
+        with open(headers_path, "r") as src:
+            cached_headers = json.load(src)
+        if cached_headers.get("ETag"):
+            request_headers["If-None-Match"] = cached_headers["ETag"]
+        if cached_headers.get("Last-Modified"):
+            request_headers["If-Modified-Since"] = cached_headers[
+                "Last-Modified"
+            ]
+
+    try:
+        response = http_get(url, headers=request_headers)
+        if response.status_code != 304:
+            response.raise_for_status()
+    except Exception:
+        if not cache_path.exists():
+            raise
+        logger.warning(f"Request failed, using local copy of {url}")
+        response = None
+
+    if response is None or response.status_code == 304:
+        if response is not None:
+            logger.info(f"Local copy of {url} is current")
+        with open(cache_path, "rb") as src:
+            return json.load(src)
+
+    content = response.json()
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}")
+    with open(tmp_path, "wb") as dst:
+        dst.write(response.content)
+    os.replace(tmp_path, cache_path)
+
+    with open(headers_path, "w") as dst:
+        json.dump(
+            {
+                "ETag": response.headers.get("ETag"),
+                "Last-Modified": response.headers.get("Last-Modified"),
+            },
+            dst,
+        )
+
+    return content
@@ -0,0 +1,121 @@
+"""
+Calculate land cover indicators from zonal statistics
+"""
+
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+
+def resolve_groups(
+    class_names: Iterable[str], groups: Dict[str, Dict[str, List[str]]]
+) -> Dict[str, List[str]]:
+    """
+    Resolve land cover class groups to lists of class names
+
+    Args:
+        class_names (Iterable[str]): All land cover class names (the keys of
+            `[landcover] category_map`).
+        groups (Dict[str, Dict[str, List[str]]]): Group name mapped to an
+            optional `include` list (defaults to all classes) and an optional
+            `exclude` list of class names.
+
+    Returns:
+        Dict[str, List[str]]: Group name mapped to its class names.
+    """
+    class_names = list(class_names)
+    resolved = {}
+    for group, spec in groups.items():
+        include = spec.get("include", class_names)
+        exclude = spec.get("exclude", [])
+        unknown = set(include) | set(exclude)
+        unknown -= set(class_names)
+        if unknown:
+            raise ValueError(f"Unknown classes in group {group}: {unknown}")
+        resolved[group] = [
+            i for i in class_names if i in include and i not in exclude
+        ]
+    return resolved
+
+
+def calculate_indicators(
+    df: pd.DataFrame,
+    years: List[int],
+    class_names: Iterable[str],
+    spec: dict,
+    prefix: str = "esa_lc",
+) -> pd.DataFrame:
+    """
+    Calculate land cover count, percent and change indicators
+
+    Class count columns are expected to be named `{prefix}_{year}_{class}`.
+    Column groups are resolved once and summed as NumPy arrays, producing:
+
+    - `lc_{year}_count_{group}` for each group in `spec["counts"]`
+      (`lc_{year}_count` for the `all` group)
+    - `lc_{year}_percent_{group}` for each group in `spec["percentages"]`,
+      as a percent of the `spec["percent_denominator"]` group
+    - `{group}_change` for each group in `spec["changes"]`, the change in
+      percent from the first to the last year
+
+    Args:
+        df (pd.DataFrame): Table of class counts.
+        years (List[int]): Years to calculate indicators for.
+        class_names (Iterable[str]): All land cover class names.
+        spec (dict): Indicator spec (the `[indicators]` config section).
+        prefix (str): Prefix of the class count columns.
+
+    Returns:
+        pd.DataFrame: Copy of `df` with the indicator columns added.
+    """
+    groups = resolve_groups(class_names, spec["groups"])
+    denominator = spec["percent_denominator"]
+    percent_groups = spec.get("percentages", [])
+    change_groups = spec.get("changes", [])
+    if set(change_groups) - set(percent_groups):
+        raise ValueError("Change indicators require a percent indicator")
+    count_groups = set(spec.get("counts", []))
+    count_groups |= set(percent_groups) | {denominator}
+
+    group_counts = {}
+    for year in years:
+        for group in count_groups:
+            columns = [
+                f"{prefix}_{year}_{i}"
+                for i in groups[group]
+                if f"{prefix}_{year}_{i}" in df.columns
+            ]
+            group_counts[(year, group)] = (
+                df[columns].to_numpy(dtype=np.float64).sum(axis=1)
+            )
+
+    indicators = {}
+
+    for group in spec.get("counts", []):
+        suffix = "" if group == "all" else f"_{group}"
+        for year in years:
+            indicators[f"lc_{year}_count{suffix}"] = group_counts[
+                (year, group)
+            ]
+
+    percents = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for year in years:
+            for group in percent_groups:
+                percents[(year, group)] = (
+                    group_counts[(year, group)]
+                    / group_counts[(year, denominator)]
+                    * 100
+                )
+                indicators[f"lc_{year}_percent_{group}"] = percents[
+                    (year, group)
+                ]
+
+    if len(years) > 1:
+        for group in change_groups:
+            indicators[f"{group}_change"] = (
+                percents[(years[-1], group)] - percents[(years[0], group)]
+            )
+
+    return df.join(pd.DataFrame(indicators, index=df.index))
@@ -0,0 +1,258 @@
+"""
+Products derived from processed land cover rasters
+"""
+
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import rasterio
+from affine import Affine
+from rasterio.windows import Window
+
+from raster_utils import get_cog_profile, open_cog_writer
+from zonal import CategoricalZonalStats
+
+# transition codes are `from * 256 + to`, classes are uint8 so 65535 is only
+# reachable from class 255 to class 255, which is not a land cover class
+TRANSITION_NODATA = 65535
+
+# nodata value of fractional cover rasters, for cells without valid pixels
+FRACTION_NODATA = -1.0
+
+
+def encode_transitions(
+    from_data: np.ndarray, to_data: np.ndarray, nodata=None
+) -> np.ndarray:
+    """
+    Encode class pairs as uint16 transition codes
+
+    Args:
+        from_data (np.ndarray): uint8 classes of the earlier year.
+        to_data (np.ndarray): uint8 classes of the later year.
+        nodata: Nodata value of the inputs, pixels that are nodata in either
+            year are set to TRANSITION_NODATA.
+
+    Returns:
+        np.ndarray: uint16 array of `from * 256 + to`.
+    """
+    codes = from_data.astype(np.uint16) << 8
+    codes |= to_data
+    if nodata is not None:
+        codes[(from_data == nodata) | (to_data == nodata)] = TRANSITION_NODATA
+    return codes
+
+
+def build_transition_rasters(
+    year_paths: Dict[int, Path],
+    output_paths: Dict[Tuple[int, int], Path],
+    profile: Optional[dict] = None,
+):
+    """
+    Write transition code rasters for pairs of years in a single pass
+
+    Each window is read once for every year used by any pair, and the
+    transition codes for all pairs are written before moving to the next
+    window. Outputs are written through `open_cog_writer`, so memory use
+    does not grow with the size of the grid or the number of pairs.
+
+    Args:
+        year_paths (Dict[int, Path]): Year mapped to its processed raster. All
+            rasters must share the same grid.
+        output_paths (Dict[Tuple[int, int], Path]): (from year, to year)
+            mapped to the path to write its transition raster to.
+        profile (dict): COG profile options, defaults to `get_cog_profile()`.
+    """
+    years = sorted({i for pair in output_paths for i in pair})
+    with ExitStack() as stack:
+        srcs = {
+            i: stack.enter_context(rasterio.open(year_paths[i])) for i in years
+        }
+        grid = {(i.crs, i.transform, i.width, i.height) for i in srcs.values()}
+        if len(grid) != 1:
+            raise ValueError("Rasters do not share a grid")
+
+        first_src = srcs[years[0]]
+        nodata = first_src.nodata
+        meta = first_src.meta.copy()
+        meta.update(dtype="uint16", nodata=TRANSITION_NODATA)
+        windows = [window for ji, window in first_src.block_windows(1)]
+
+        dsts = {
+            pair: stack.enter_context(
+                open_cog_writer(
+                    output_path, meta, profile or get_cog_profile()
+                )
+            )
+            for pair, output_path in output_paths.items()
+        }
+
+        for window in windows:
+            data = {i: src.read(1, window=window) for i, src in srcs.items()}
+            for (from_year, to_year), dst in dsts.items():
+                dst.write(
+                    encode_transitions(
+                        data[from_year], data[to_year], nodata=nodata
+                    ),
+                    1,
+                    window=window,
+                )
+
+
+def count_cells(mask: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Count the True pixels in each `factor` x `factor` cell of a mask
+
+    Args:
+        mask (np.ndarray): 2D boolean array with a shape divisible by factor.
+        factor (int): Number of pixels along each side of a cell.
+
+    Returns:
+        np.ndarray: Counts with a shape `factor` times smaller.
+    """
+    rows, cols = mask.shape
+    return mask.reshape(rows // factor, factor, cols // factor, factor).sum(
+        axis=(1, 3)
+    )
+
+
+def build_fractional_cover(
+    raster_path: Union[Path, str],
+    output_path: Union[Path, str],
+    classes: Dict[int, str],
+    factor: int,
+    tile_size: int = 512,
+    profile: Optional[dict] = None,
+):
+    """
+    Aggregate a categorical raster to the fraction of each class per coarse
+    cell
+
+    The output has one float32 band per class (described by the class
+    name), on a grid `factor` times coarser than the input. The input is
+    read in tiles of `tile_size * factor` pixels and each class is counted
+    by reshaping the tile into (cell, pixel) axes and summing, so memory use
+    is bounded by the tile size regardless of the size of the raster (the
+    output is written through `open_cog_writer`). Tiles match the 512 pixel
+    blocks of the output COG by default.
+
+    Fractions are of the valid (not nodata) pixels in each cell, cells with
+    no valid pixels are set to FRACTION_NODATA. A class equal to the nodata
+    value of the raster gets no band.
+
+    Args:
+        raster_path (Union[Path, str]): Path to a categorical raster.
+        output_path (Union[Path, str]): Path to write the multi-band COG to.
+        classes (Dict[int, str]): Class value mapped to class name.
+        factor (int): Number of input pixels along each side of a cell.
+        tile_size (int): Number of cells along each side of a tile.
+        profile (dict): COG profile options, defaults to `get_cog_profile()`
+            with average resampling for overviews.
+    """
+    with rasterio.open(raster_path) as src:
+        nodata = src.nodata
+        classes = {k: v for k, v in classes.items() if k != nodata}
+        width = -(-src.width // factor)
+        height = -(-src.height // factor)
+
+        meta = src.meta.copy()
+        meta.update(
+            dtype="float32",
+            count=len(classes),
+            nodata=FRACTION_NODATA,
+            width=width,
+            height=height,
+            transform=src.transform * Affine.scale(factor),
+        )
+
+        with open_cog_writer(
+            output_path,
+            meta,
+            profile or get_cog_profile(overview_resampling="AVERAGE"),
+        ) as dst:
+            for row in range(0, height, tile_size):
+                for col in range(0, width, tile_size):
+                    out_window = Window(
+                        col,
+                        row,
+                        min(tile_size, width - col),
+                        min(tile_size, height - row),
+                    )
+                    h, w = int(out_window.height), int(out_window.width)
+
+                    # pad tiles at the edge of the raster to whole cells
+                    data = src.read(
+                        1,
+                        window=Window(
+                            col * factor, row * factor, w * factor, h * factor
+                        ).intersection(Window(0, 0, src.width, src.height)),
+                    )
+                    valid = np.zeros((h * factor, w * factor), dtype=bool)
+                    valid[: data.shape[0], : data.shape[1]] = (
+                        True if nodata is None else data != nodata
+                    )
+                    data = np.pad(
+                        data,
+                        (
+                            (0, h * factor - data.shape[0]),
+                            (0, w * factor - data.shape[1]),
+                        ),
+                    )
+
+                    valid_counts = count_cells(valid, factor)
+                    fractions = np.full(
+                        (len(classes), h, w), FRACTION_NODATA, dtype="float32"
+                    )
+                    has_data = valid_counts > 0
+                    for i, value in enumerate(classes):
+                        fractions[i][has_data] = (
+                            count_cells((data == value) & valid, factor)[
+                                has_data
+                            ]
+                            / valid_counts[has_data]
+                        )
+                    dst.write(fractions, window=out_window)
+
+            dst.descriptions = tuple(classes.values())
+
+
+def transition_table(
+    zonal_stats: CategoricalZonalStats,
+    raster_path: Union[Path, str],
+    category_map: Dict[int, str],
+) -> pd.DataFrame:
+    """
+    Count the land cover transitions within each zone
+
+    Only the transitions between classes in `category_map` are counted, so
+    the counts are indexed by the number of classes squared rather than by
+    every possible uint16 transition code.
+
+    Args:
+        zonal_stats (CategoricalZonalStats): Zonal statistics for the zones.
+        raster_path (Union[Path, str]): Path to a transition code raster.
+        category_map (Dict[int, str]): Class value mapped to class name.
+
+    Returns:
+        pd.DataFrame: One row per zone and transition that occurs in it, with
+            the zone id, `from_class`, `to_class` and pixel `count`.
+    """
+    classes = np.array(sorted(category_map))
+    codes = (classes[:, None] << 8 | classes[None, :]).ravel()
+    counts = zonal_stats.band_counts(raster_path, [1], values=codes)[0]
+    zone_idx, code_idx = np.nonzero(counts)
+
+    return pd.DataFrame(
+        {
+            zonal_stats.id_field: zonal_stats.zone_ids[zone_idx],
+            "from_class": [
+                category_map[i] for i in classes[code_idx // len(classes)]
+            ],
+            "to_class": [
+                category_map[i] for i in classes[code_idx % len(classes)]
+            ],
+            "count": counts[zone_idx, code_idx],
+        }
+    )
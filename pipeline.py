@@ -0,0 +1,518 @@
+"""
+Run the boundary, land cover and integration scripts as a pipeline
+
+Stages are run once their dependencies have finished, so independent
+stages (boundary and land cover downloads) run concurrently. Each stage is
+fingerprinted from its code, its slice of the config (without the
+execution-only EXECUTION_KEYS), its input files and the fingerprints of the
+stages it depends on, and is skipped if the fingerprint matches the last
+successful run and its outputs exist.
+
+The scripts skip outputs that already exist, so when the config slice of a
+stage has changed since its last successful run the stage is run with
+OVERWRITE_ENV_VAR set, which makes the scripts replace their outputs.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import OVERWRITE_ENV_VAR, get_config
+
+# directory containing the pipeline scripts
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+# config keys (dotted paths) that only change how a stage runs and not what
+# it produces, they are left out of config fingerprints so tuning them does
+# not rerun a stage or replace its outputs
+EXECUTION_KEYS = [
+    "boundary.max_workers",
+    "boundary.cache_dir",
+    "boundary.cache_max_size_gb",
+    "boundary.sync_from",
+    "boundary.streaming_ingest",
+    "boundary.stream_batch_size",
+    "landcover.api_key_env_var",
+    "landcover.overwrite_download",
+    "landcover.overwrite_processing",
+    "landcover.download_workers",
+    "landcover.queue_depth",
+    "landcover.keep_downloads",
+    "landcover.window_memory_mb",
+    "landcover.max_workers",
+    "landcover.pool_type",
+    "landcover.extract_netcdf",
+    "landcover.use_tmp_copies",
+    "landcover.cog.num_threads",
+]
+
+
+def hash_file(path: Path) -> str:
+    """
+    Get the SHA-256 hex digest of a file, or "missing" if it does not exist
+    """
+    if not path.exists():
+        return "missing"
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as src:
+        for chunk in iter(lambda: src.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class PipelineStage:
+    """
+    A script run as a single stage of the pipeline
+    """
+
+    def __init__(
+        self,
+        name: str,
+        script: str,
+        config_keys: List[str],
+        deps: Optional[List[str]] = None,
+        code_files: Optional[List[str]] = None,
+        input_paths: Optional[List[Path]] = None,
+        output_paths: Optional[List[Path]] = None,
+    ):
+        """
+        Args:
+            name (str): Name of the stage.
+            script (str): Script run by the stage, relative to SCRIPT_DIR.
+            config_keys (List[str]): Top level config keys used by the stage.
+            deps (List[str]): Names of the stages that must finish first.
+            code_files (List[str]): Modules used by the script, relative to
+                SCRIPT_DIR.
+            input_paths (List[Path]): Input files that are not produced by
+                another stage.
+            output_paths (List[Path]): Files the stage produces. The stage is
+                run again if any of them are missing.
+        """
+        self.name = name
+        self.script = script
+        self.config_keys = config_keys
+        self.deps = deps or []
+        self.code_files = code_files or []
+        self.input_paths = input_paths or []
+        self.output_paths = output_paths or []
+
+    def config_fingerprint(self, config: dict) -> str:
+        """
+        Fingerprint the slice of the config used by the stage
+
+        Keys in EXECUTION_KEYS are left out, so only changes that affect
+        the outputs of the stage change the fingerprint.
+
+        Args:
+            config (dict): The full pipeline config.
+
+        Returns:
+            str: SHA-256 hex digest of the config keys of the stage.
+        """
+        content = copy.deepcopy({i: config.get(i) for i in self.config_keys})
+        for key in EXECUTION_KEYS:
+            *parents, name = key.split(".")
+            section = content
+            for i in parents:
+                section = section.get(i)
+                if not isinstance(section, dict):
+                    break
+            else:
+                section.pop(name, None)
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def fingerprint(self, config: dict, dep_fingerprints: Dict[str, str]):
+        """
+        Fingerprint the code, config and inputs of the stage
+
+        Args:
+            config (dict): The full pipeline config.
+            dep_fingerprints (Dict[str, str]): Fingerprints of the stages this
+                stage depends on.
+
+        Returns:
+            str: SHA-256 hex digest identifying this run of the stage.
+        """
+        content = {
+            "code": {
+                i: hash_file(SCRIPT_DIR / i)
+                for i in [self.script, *self.code_files]
+            },
+            "config": self.config_fingerprint(config),
+            "inputs": {str(i): hash_file(i) for i in self.input_paths},
+            "deps": {i: dep_fingerprints[i] for i in self.deps},
+        }
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def outputs_exist(self) -> bool:
+        """Check if all outputs of the stage exist"""
+        return all(i.exists() for i in self.output_paths)
+
+
+def get_stages(config: dict) -> Dict[str, PipelineStage]:
+    """
+    Define the pipeline stages from the config
+
+    Args:
+        config (dict): The full pipeline config.
+
+    Returns:
+        Dict[str, PipelineStage]: Stages by name.
+    """
+    base_path = Path(config["base_path"])
+    boundary_config = config["boundary"]
+    lc_config = config["landcover"]
+
+    boundary_dir = (
+        base_path
+        / "geoBoundaries"
+        / f'{boundary_config["version"]}_{boundary_config["gb_data_hash"]}_{boundary_config["gb_web_hash"]}'
+    )
+
+    # the land cover area of interest can be set from boundary metadata
+    # files, in which case it has to wait for the boundary stage
+    aoi_meta_paths = [
+        base_path / i for i in lc_config.get("aoi_meta_paths", [])
+    ]
+
+    output_paths = {
+        "csv": base_path / "output" / "ghana_adm2_data.csv",
+        "geojson": base_path / "output" / "ghana_adm2_data.geojson",
+        "parquet": base_path / "output" / "ghana_adm2_data.parquet",
+    }
+
+    stages = [
+        PipelineStage(
+            name="boundary",
+            script="1_boundary.py",
+            config_keys=["base_path", "boundary"],
+            code_files=[
+                "catalog.py",
+                "config.py",
+                "download_cache.py",
+                "http_utils.py",
+                "vector_utils.py",
+            ],
+            output_paths=[boundary_dir / "catalog.sqlite"],
+        ),
+        PipelineStage(
+            name="landcover",
+            script="2_landcover.py",
+            config_keys=["base_path", "landcover"],
+            deps=["boundary"] if aoi_meta_paths else [],
+            code_files=[
+                "config.py",
+                "landcover_products.py",
+                "raster_utils.py",
+                "reclassify.py",
+                "zonal.py",
+            ],
+            input_paths=aoi_meta_paths,
+            output_paths=[
+                base_path / lc_config["dataset_name"] / f"esa_lc_{year}.tif"
+                for year in lc_config["years"]
+            ]
+            + (
+                [base_path / lc_config["dataset_name"] / "esa_lc_stack.tif"]
+                if lc_config.get("output_stack")
+                else []
+            )
+            + [
+                base_path
+                / lc_config["dataset_name"]
+                / f"esa_lc_transition_{from_year}_{to_year}.tif"
+                for from_year, to_year in lc_config.get("transitions", [])
+            ]
+            + [
+                base_path
+                / lc_config["dataset_name"]
+                / f"esa_lc_fraction_{year}.tif"
+                for year in lc_config["years"]
+                if lc_config.get("fraction_factor")
+            ],
+        ),
+        PipelineStage(
+            name="integrate",
+            script="3_integrate.py",
+            config_keys=[
+                "base_path",
+                "treatment_path",
+                "boundary",
+                "landcover",
+                "integrate",
+                "indicators",
+            ],
+            deps=["boundary", "landcover"],
+            code_files=[
+                "catalog.py",
+                "config.py",
+                "indicators.py",
+                "landcover_products.py",
+                "raster_utils.py",
+                "vector_utils.py",
+                "zonal.py",
+            ],
+            input_paths=[base_path / config["treatment_path"]],
+            output_paths=[
+                output_paths[i] for i in config["integrate"]["output_formats"]
+            ]
+            + (
+                [base_path / "output" / "ghana_adm2_transitions.csv"]
+                if lc_config.get("transitions")
+                else []
+            ),
+        ),
+    ]
+    return {i.name: i for i in stages}
+
+
+class Pipeline:
+    """
+    Run pipeline stages in dependency order, skipping unchanged stages
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        stages: Dict[str, PipelineStage],
+        state_path: Path,
+        max_workers: int = 2,
+        force_stages: Optional[List[str]] = None,
+    ):
+        """
+        Args:
+            config (dict): The full pipeline config.
+            stages (Dict[str, PipelineStage]): Stages by name.
+            state_path (Path): Path to the file storing the fingerprint and
+                config fingerprint of the last successful run of each stage.
+            max_workers (int): Maximum number of stages run concurrently.
+            force_stages (List[str]): Stages to run even if unchanged.
+        """
+        self.config = config
+        self.stages = stages
+        self.state_path = Path(state_path)
+        self.max_workers = max_workers
+        self.force_stages = set(force_stages or [])
+
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(
+                        f"Unknown dependency of {stage.name}: {dep}"
+                    )
+
+        self._state_lock = threading.Lock()
+
+    def get_logger(self):
+        """
+        Retrieve and return the base logger to be used for the pipeline
+        """
+        return logging.getLogger("pipeline")
+
+    def load_state(self) -> Dict[str, Dict[str, str]]:
+        """
+        Load the fingerprints of the last successful stage runs
+
+        Returns:
+            Dict[str, Dict[str, str]]: Stage name mapped to the `fingerprint`
+                and `config` fingerprint of its last successful run.
+        """
+        if not self.state_path.exists():
+            return {}
+        with open(self.state_path, "r") as src:
+            state = json.load(src)
+        # state files written before config fingerprints were recorded only
+        # hold the stage fingerprint
+        return {
+            k: v if isinstance(v, dict) else {"fingerprint": v}
+            for k, v in state.items()
+        }
+
+    def save_fingerprint(
+        self, name: str, fingerprint: str, config_fingerprint: str
+    ):
+        """Record a successful run of a stage"""
+        with self._state_lock:
+            state = self.load_state()
+            state[name] = {
+                "fingerprint": fingerprint,
+                "config": config_fingerprint,
+            }
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.state_path.with_name(f"{self.state_path.name}.tmp")
+            with open(tmp_path, "w") as dst:
+                json.dump(state, dst, indent=4)
+            os.replace(tmp_path, self.state_path)
+
+    def run_stage(
+        self,
+        stage: PipelineStage,
+        fingerprint: str,
+        config_fingerprint: str,
+        overwrite: bool = False,
+    ) -> bool:
+        """
+        Run the script of a stage in a separate process
+
+        Args:
+            stage (PipelineStage): The stage to run.
+            fingerprint (str): Fingerprint recorded if the stage succeeds.
+            config_fingerprint (str): Config fingerprint recorded if the
+                stage succeeds.
+            overwrite (bool): Set OVERWRITE_ENV_VAR so the script replaces
+                its existing outputs.
+
+        Returns:
+            bool: True if the script finished successfully.
+        """
+        logger = self.get_logger()
+
+        env = dict(os.environ)
+        if overwrite:
+            logger.info(
+                f"Running stage: {stage.name} (config changed, replacing "
+                "existing outputs)"
+            )
+            env[OVERWRITE_ENV_VAR] = "1"
+        else:
+            logger.info(f"Running stage: {stage.name}")
+            env.pop(OVERWRITE_ENV_VAR, None)
+
+        result = subprocess.run(
+            [sys.executable, stage.script],
+            cwd=SCRIPT_DIR,
+            env=env,
+            check=False,
+        )
+        if result.returncode != 0:
+            logger.error(
+                f"Stage {stage.name} failed with exit code {result.returncode}"
+            )
+            return False
+
+        self.save_fingerprint(stage.name, fingerprint, config_fingerprint)
+        logger.info(f"Finished stage: {stage.name}")
+        return True
+
+    def main(self) -> bool:
+        """
+        Run all stages, starting each stage as soon as its dependencies have
+        finished
+
+        Stages whose dependencies failed are not run. Stages whose config
+        changed since their last successful run replace their existing
+        outputs.
+
+        Returns:
+            bool: True if every stage finished or was skipped as unchanged.
+        """
+        logger = self.get_logger()
+
+        state = self.load_state()
+        fingerprints = {}
+        pending = dict(self.stages)
+        failed = set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                started = len(pending)
+                for name, stage in list(pending.items()):
+                    if any(i in failed for i in stage.deps):
+                        logger.warning(
+                            f"Not running stage {name}, a dependency failed"
+                        )
+                        failed.add(name)
+                        del pending[name]
+                    elif all(i in fingerprints for i in stage.deps):
+                        del pending[name]
+                        fingerprint = stage.fingerprint(
+                            self.config, fingerprints
+                        )
+                        config_fingerprint = stage.config_fingerprint(
+                            self.config
+                        )
+                        last_run = state.get(name, {})
+                        if (
+                            last_run.get("fingerprint") == fingerprint
+                            and stage.outputs_exist()
+                            and name not in self.force_stages
+                        ):
+                            logger.info(f"Skipping unchanged stage: {name}")
+                            fingerprints[name] = fingerprint
+                            continue
+                        # outputs from a run with a different config are
+                        # replaced, other runs only fill in missing outputs
+                        overwrite = last_run.get("config") not in (
+                            None,
+                            config_fingerprint,
+                        )
+                        future = executor.submit(
+                            self.run_stage,
+                            stage,
+                            fingerprint,
+                            config_fingerprint,
+                            overwrite,
+                        )
+                        running[future] = (name, fingerprint)
+
+                if not running:
+                    if len(pending) == started:
+                        raise ValueError(
+                            f"Stages have circular dependencies: {list(pending)}"
+                        )
+                    # skipped stages may have unblocked others
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, fingerprint = running.pop(future)
+                    if future.result():
+                        fingerprints[name] = fingerprint
+                    else:
+                        failed.add(name)
+
+        if failed:
+            logger.error(f"Failed stages: {sorted(failed)}")
+        else:
+            logger.info("Pipeline finished")
+        return not failed
+
+
+if __name__ == "__main__":
+    config = get_config()
+    pipeline_config = config.get("pipeline", {})
+
+    base_path = Path(config["base_path"])
+    base_path.mkdir(parents=True, exist_ok=True)
+
+    # set logging configuration
+    logging.basicConfig(
+        filename=base_path / "pipeline.log",
+        filemode="a",
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+
+    pipeline = Pipeline(
+        config,
+        get_stages(config),
+        state_path=base_path
+        / pipeline_config.get("state_path", "pipeline_state.json"),
+        max_workers=pipeline_config.get("max_workers", 2),
+        force_stages=pipeline_config.get("force_stages", []),
+    )
+    if not pipeline.main():
+        sys.exit(1)
@@ -0,0 +1,390 @@
+"""
+Helper functions for windowed raster processing
+"""
+
+import json
+import math
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+import shapely
+from affine import Affine
+from rasterio.windows import Window
+
+
+def get_aoi_bounds(
+    bbox: Optional[List[float]] = None,
+    meta_paths: Optional[List[Union[Path, str]]] = None,
+) -> Optional[Tuple[float, float, float, float]]:
+    """
+    Build the bounds of an area of interest
+
+    Args:
+        bbox (List[float]): Bounding box as [minx, miny, maxx, maxy].
+        meta_paths (List[Union[Path, str]]): Paths to boundary `.meta.json`
+            files whose `spatial_extent` WKT should be included.
+
+    Returns:
+        Tuple[float, float, float, float]: Union of all provided extents as
+            (minx, miny, maxx, maxy), or None if nothing was provided.
+    """
+    geoms = []
+    if bbox:
+        geoms.append(shapely.box(*bbox))
+    for meta_path in meta_paths or []:
+        with open(meta_path, "r") as src:
+            meta = json.load(src)
+        geoms.append(shapely.from_wkt(meta["spatial_extent"]))
+
+    if not geoms:
+        return None
+    return tuple(shapely.union_all(geoms).bounds)
+
+
+def get_aoi_window(
+    transform: Affine,
+    width: int,
+    height: int,
+    bounds: Tuple[float, float, float, float],
+    buffer: float = 0,
+) -> Window:
+    """
+    Get the pixel window of a raster covering an area of interest
+
+    Args:
+        transform (Affine): Transform of the raster.
+        width (int): Width of the raster in pixels.
+        height (int): Height of the raster in pixels.
+        bounds (Tuple[float, float, float, float]): Area of interest as
+            (minx, miny, maxx, maxy) in the raster's CRS.
+        buffer (float): Distance in CRS units to expand the bounds by.
+
+    Returns:
+        Window: Whole pixel window covering the buffered bounds, limited to
+            the extent of the raster.
+    """
+    minx, miny, maxx, maxy = bounds
+    window = rasterio.windows.from_bounds(
+        minx - buffer,
+        miny - buffer,
+        maxx + buffer,
+        maxy + buffer,
+        transform=transform,
+    )
+    col_off = math.floor(window.col_off)
+    row_off = math.floor(window.row_off)
+    window = Window(
+        col_off,
+        row_off,
+        math.ceil(window.col_off + window.width) - col_off,
+        math.ceil(window.row_off + window.height) - row_off,
+    )
+    return window.intersection(Window(0, 0, width, height))
+
+
+def plan_windows(
+    window: Window,
+    block_size: int,
+    max_bytes: int,
+    itemsize: int = 1,
+    native_shape: Optional[Tuple[int, int]] = None,
+) -> List[Window]:
+    """
+    Split a window into large windows of whole native or output blocks
+
+    If the native block (e.g. NetCDF chunk) of the input fits within
+    `max_bytes`, windows are made of whole native blocks, aligned to the
+    input's block grid, so each compressed block is only read and
+    decompressed once. Otherwise windows are whole multiples of
+    `block_size` relative to the origin of `window`, so each one covers
+    whole output tiles.
+
+    Windows are full width strips as tall as fit within `max_bytes`, or
+    runs of blocks within a single row of blocks if one full width row of
+    blocks does not fit.
+
+    Args:
+        window (Window): Window to split, e.g. the area of interest.
+        block_size (int): Tile size of the output.
+        max_bytes (int): Memory budget for the data of a single window. At
+            least one block is always included.
+        itemsize (int): Bytes per pixel.
+        native_shape (Tuple[int, int]): (height, width) of the native blocks
+            of the input, e.g. `src.block_shapes[0]`.
+
+    Returns:
+        List[Window]: Windows covering `window`, in row-major order.
+    """
+    row_start, col_start = int(window.row_off), int(window.col_off)
+    row_stop = row_start + int(window.height)
+    col_stop = col_start + int(window.width)
+
+    if native_shape and native_shape[0] * native_shape[1] * itemsize <= (
+        max_bytes
+    ):
+        # native blocks are aligned to the origin of the raster
+        unit_height, unit_width = native_shape
+        row_origin = col_origin = 0
+    else:
+        unit_height = unit_width = block_size
+        row_origin, col_origin = row_start, col_start
+
+    # width of the blocks spanned by the window
+    span_width = (
+        -(-(col_stop - col_origin) // unit_width)
+        - (col_start - col_origin) // unit_width
+    ) * unit_width
+    max_pixels = max_bytes // itemsize
+
+    if span_width * unit_height <= max_pixels:
+        row_step = (
+            max(1, max_pixels // span_width // unit_height) * unit_height
+        )
+        col_step = span_width
+    else:
+        row_step = unit_height
+        col_step = max(1, max_pixels // unit_height // unit_width) * unit_width
+
+    def edges(start: int, stop: int, origin: int, step: int) -> List[int]:
+        first = origin + ((start - origin) // step + 1) * step
+        return [start, *range(first, stop, step), stop]
+
+    row_edges = edges(row_start, row_stop, row_origin, row_step)
+    col_edges = edges(col_start, col_stop, col_origin, col_step)
+
+    return [
+        Window(col, row, col_end - col, row_end - row)
+        for row, row_end in zip(row_edges, row_edges[1:])
+        for col, col_end in zip(col_edges, col_edges[1:])
+    ]
+
+
+def get_cog_profile(
+    compress: str = "LZW",
+    level: Optional[int] = None,
+    predictor: Optional[int] = None,
+    blocksize: int = 512,
+    overviews: str = "AUTO",
+    overview_resampling: str = "MODE",
+    overview_count: Optional[int] = None,
+    num_threads: Optional[Union[int, str]] = None,
+) -> dict:
+    """
+    Build the rasterio profile options for writing a Cloud Optimized GeoTIFF
+
+    Args:
+        compress (str): Compression codec (e.g. "ZSTD", "DEFLATE", "LZW").
+        level (int): Compression level, uses the codec default if not set.
+        predictor (int): TIFF predictor (1 none, 2 horizontal, 3 floating
+            point), uses the driver default if not set.
+        blocksize (int): Width and height of the internal tiles in pixels.
+        overviews (str): Overview generation ("AUTO" or "NONE").
+        overview_resampling (str): Resampling used for overviews, "MODE" or
+            "NEAREST" for categorical data.
+        overview_count (int): Number of overview levels, all levels down to
+            a single tile if not set.
+        num_threads (Union[int, str]): Threads used for compression, e.g.
+            "ALL_CPUS".
+
+    Returns:
+        dict: Profile options to update a raster's profile with.
+    """
+    profile = {
+        "driver": "COG",
+        "compress": compress,
+        "blocksize": blocksize,
+        "overviews": overviews,
+        "overview_resampling": overview_resampling,
+    }
+    optional = {
+        "level": level,
+        "predictor": predictor,
+        "overview_count": overview_count,
+        "num_threads": num_threads,
+    }
+    profile.update({k: v for k, v in optional.items() if v})
+    return profile
+
+
+@contextmanager
+def open_cog_writer(
+    output_path: Union[Path, str], meta: dict, profile: dict
+) -> Iterator[rasterio.io.DatasetWriter]:
+    """
+    Open a writer that produces a COG without holding it in memory
+
+    GDAL's COG driver keeps the whole raster in memory until it is closed,
+    so data is instead written to a temporary tiled GeoTIFF next to the
+    output, which is converted to a COG once the writer is closed.
+
+    Args:
+        output_path (Union[Path, str]): Path of the COG to write.
+        meta (dict): Raster metadata (dtype, count, size, crs, transform,
+            nodata).
+        profile (dict): COG profile options from `get_cog_profile`.
+
+    Yields:
+        rasterio.io.DatasetWriter: Writer for the temporary GeoTIFF.
+    """
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(f"{output_path.name}.tmp.tif")
+
+    cog_options = {k: v for k, v in profile.items() if k != "driver"}
+    tmp_meta = {
+        k: v for k, v in meta.items() if k not in profile and k != "driver"
+    }
+    tmp_meta.update(
+        driver="GTiff",
+        tiled=True,
+        blockxsize=profile["blocksize"],
+        blockysize=profile["blocksize"],
+        compress=profile["compress"],
+        bigtiff="IF_SAFER",
+    )
+
+    try:
+        with rasterio.open(tmp_path, "w", **tmp_meta) as dst:
+            yield dst
+        rasterio.shutil.copy(
+            tmp_path, output_path, driver="COG", **cog_options
+        )
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+class BlockHistogram:
+    """
+    Per block class counts of an 8 bit categorical raster
+
+    The raster is divided into `block_size` square blocks from its origin
+    and the count of every value within each block is stored in a sidecar
+    file next to the raster (`{raster name}.hist.npz`, or
+    `{raster name}.band{band}.hist.npz` for each band of a multi-band
+    raster). Zonal statistics can then use the counts of blocks that fall
+    entirely within a zone instead of reading their pixels.
+    """
+
+    n_values = 256
+
+    def __init__(self, width: int, height: int, block_size: int = 512):
+        """
+        Args:
+            width (int): Width of the raster in pixels.
+            height (int): Height of the raster in pixels.
+            block_size (int): Width and height of each block in pixels.
+        """
+        self.width = width
+        self.height = height
+        self.block_size = block_size
+        self.counts = np.zeros(
+            (
+                -(-height // block_size),
+                -(-width // block_size),
+                self.n_values,
+            ),
+            dtype=np.uint32,
+        )
+
+    @classmethod
+    def from_raster(
+        cls,
+        raster_path: Union[Path, str],
+        band: int = 1,
+        block_size: int = 512,
+    ) -> "BlockHistogram":
+        """
+        Count the values of an existing raster, one row of blocks at a time
+
+        Args:
+            raster_path (Union[Path, str]): Path to an 8 bit raster.
+            band (int): Band to count (1-based).
+            block_size (int): Width and height of each block in pixels.
+
+        Returns:
+            BlockHistogram: The block counts of the band.
+        """
+        with rasterio.open(raster_path) as src:
+            histogram = cls(src.width, src.height, block_size=block_size)
+            for row in range(0, src.height, block_size):
+                window = Window(
+                    0, row, src.width, min(block_size, src.height - row)
+                )
+                histogram.add(window, src.read(band, window=window))
+        return histogram
+
+    @staticmethod
+    def sidecar_path(
+        raster_path: Union[Path, str], band: Optional[int] = None
+    ) -> Path:
+        """
+        Path of the histogram sidecar of a raster, or of one band of a
+        multi-band raster
+        """
+        raster_path = Path(raster_path)
+        if band is None:
+            return raster_path.with_name(f"{raster_path.name}.hist.npz")
+        return raster_path.with_name(f"{raster_path.name}.band{band}.hist.npz")
+
+    def add(self, window: Window, data: np.ndarray):
+        """
+        Count the values of a window of the raster
+
+        Args:
+            window (Window): Window of the raster.
+            data (np.ndarray): 2D uint8 values of the window.
+        """
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        rows = np.arange(row_off, row_off + data.shape[0]) // self.block_size
+        cols = np.arange(col_off, col_off + data.shape[1]) // self.block_size
+        rows -= rows[0]
+        cols -= cols[0]
+        n_rows, n_cols = rows[-1] + 1, cols[-1] + 1
+
+        keys = (rows[:, None] * n_cols + cols[None, :]) * self.n_values
+        keys = keys + data
+        counts = np.bincount(
+            keys.ravel(), minlength=n_rows * n_cols * self.n_values
+        ).reshape(n_rows, n_cols, self.n_values)
+
+        block_row = row_off // self.block_size
+        block_col = col_off // self.block_size
+        self.counts[
+            block_row : block_row + n_rows, block_col : block_col + n_cols
+        ] += counts.astype(np.uint32)
+
+    def save(self, raster_path: Union[Path, str], band: Optional[int] = None):
+        """Write the counts to the sidecar of a raster (or of a band)"""
+        np.savez_compressed(
+            self.sidecar_path(raster_path, band),
+            counts=self.counts,
+            shape=np.array([self.height, self.width]),
+            block_size=np.array(self.block_size),
+        )
+
+    @classmethod
+    def load(
+        cls, raster_path: Union[Path, str], band: Optional[int] = None
+    ) -> Optional["BlockHistogram"]:
+        """
+        Load the sidecar of a raster (or of a band of a multi-band raster)
+
+        Returns:
+            BlockHistogram: The block counts, or None if the raster has no
+                sidecar or the sidecar is older than the raster.
+        """
+        sidecar_path = cls.sidecar_path(raster_path, band)
+        if (
+            not sidecar_path.exists()
+            or sidecar_path.stat().st_mtime < Path(raster_path).stat().st_mtime
+        ):
+            return None
+
+        with np.load(sidecar_path) as src:
+            height, width = src["shape"]
+            histogram = cls(int(width), int(height), int(src["block_size"]))
+            histogram.counts = src["counts"]
+        return histogram
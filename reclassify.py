@@ -0,0 +1,86 @@
+"""
+Lookup-table based reclassification of categorical raster values
+"""
+
+from typing import Dict, List, Union
+
+import numpy as np
+
+
+class LookupReclassifier:
+    """
+    Reclassify categorical raster values using a dense lookup table
+
+    The mapping is compiled once into a NumPy array indexed by the input
+    value, so reclassifying a block is a single vectorized indexing
+    operation rather than a Python call per pixel.
+    """
+
+    def __init__(
+        self,
+        mapping: Dict[Union[str, int], List[int]],
+        default: int = 0,
+        dtype: Union[str, np.dtype] = "uint8",
+    ):
+        """
+        Args:
+            mapping (dict): Output value mapped to the list of input values that
+                should be reclassified to it (the `[landcover] mapping` format).
+            default (int): Value assigned to any input value not in the mapping.
+            dtype (Union[str, np.dtype]): Integer dtype of the input raster.
+                Output values keep this dtype.
+        """
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind not in "ui":
+            raise ValueError(f"Integer dtype required, got {self.dtype}")
+
+        self.default = default
+        self.mapping = {
+            int(vi): int(k) for k, v in mapping.items() for vi in v
+        }
+
+        info = np.iinfo(self.dtype)
+        for value in [self.default, *self.mapping.values()]:
+            if not info.min <= value <= info.max:
+                raise ValueError(
+                    f"Output value {value} does not fit in {self.dtype}"
+                )
+
+        # small integer types get a table covering every possible value so
+        # that lookups need no bounds checks
+        if self.dtype.itemsize <= 2:
+            self.offset = int(info.min)
+            size = int(info.max) - int(info.min) + 1
+        else:
+            self.offset = min([0, *self.mapping.keys()])
+            size = max([0, *self.mapping.keys()]) - self.offset + 1
+
+        self.table = np.full(size, self.default, dtype=self.dtype)
+        for in_value, out_value in self.mapping.items():
+            if not 0 <= in_value - self.offset < size:
+                raise ValueError(
+                    f"Input value {in_value} does not fit in {self.dtype}"
+                )
+            self.table[in_value - self.offset] = out_value
+
+    def __call__(self, data: np.ndarray) -> np.ndarray:
+        """
+        Reclassify an array of input values
+
+        Args:
+            data (np.ndarray): Array of input values.
+
+        Returns:
+            np.ndarray: Reclassified array with the same shape and dtype as the
+                lookup table.
+        """
+        if data.dtype == self.dtype and self.dtype.itemsize <= 2:
+            if self.offset:
+                return self.table[data.astype(np.int32) - self.offset]
+            return self.table[data]
+
+        index = data.astype(np.int64) - self.offset
+        valid = (index >= 0) & (index < self.table.size)
+        out_data = np.full(data.shape, self.default, dtype=self.dtype)
+        out_data[valid] = self.table[index[valid]]
+        return out_data
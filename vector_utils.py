@@ -0,0 +1,355 @@
+"""
+Helper functions for working with vector boundary data
+"""
+
+import json
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
+
+# file extension for each supported boundary output format
+FORMAT_EXTENSIONS = {
+    "geojson": ".geojson",
+    "gpkg": ".gpkg",
+    "parquet": ".parquet",
+}
+
+# approximate length of a degree at the equator, used to convert simplify
+# tolerances in meters for data in geographic coordinates
+METERS_PER_DEGREE = 111320
+
+
+def write_boundary(
+    gdf: gpd.GeoDataFrame,
+    path: Union[Path, str],
+    row_group_size: int = 10000,
+):
+    """
+    Write boundary data to a file, with the format based on the extension
+
+    GeoParquet files are written with a `bbox` covering column and row groups
+    of `row_group_size` features so that readers can skip row groups outside
+    of a bounding box.
+
+    Args:
+        gdf (gpd.GeoDataFrame): Boundary data.
+        path (Union[Path, str]): Output path ending in .geojson, .gpkg or
+            .parquet.
+        row_group_size (int): Maximum features per GeoParquet row group.
+    """
+    suffix = Path(path).suffix
+    if suffix == ".parquet":
+        gdf.to_parquet(
+            path,
+            index=False,
+            write_covering_bbox=True,
+            row_group_size=row_group_size,
+        )
+    elif suffix == ".gpkg":
+        gdf.to_file(path, driver="GPKG")
+    elif suffix == ".geojson":
+        gdf.to_file(path, driver="GeoJSON")
+    else:
+        raise ValueError(f"Unsupported boundary format: {suffix}")
+
+
+def read_boundary(
+    path: Union[Path, str],
+    columns: Optional[List[str]] = None,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+) -> gpd.GeoDataFrame:
+    """
+    Read boundary data, only loading the requested columns and features
+
+    For GeoParquet, the columns and bbox are pushed down to the reader so
+    unused columns and row groups are never parsed.
+
+    Args:
+        path (Union[Path, str]): Path to a .geojson, .gpkg or .parquet file.
+        columns (List[str]): Attribute columns to load (geometry is always
+            loaded). Loads all columns if not given.
+        bbox (Tuple[float, float, float, float]): Only load features
+            intersecting (minx, miny, maxx, maxy).
+
+    Returns:
+        gpd.GeoDataFrame: The boundary data.
+    """
+    if Path(path).suffix == ".parquet":
+        if columns is not None:
+            columns = [*columns, "geometry"]
+        return gpd.read_parquet(path, columns=columns, bbox=bbox)
+    return gpd.read_file(path, columns=columns, bbox=bbox)
+
+
+def simplify_boundary(
+    gdf: gpd.GeoDataFrame, tolerance: float
+) -> gpd.GeoDataFrame:
+    """
+    Simplify boundary polygons while preserving topology
+
+    The polygons are simplified as a coverage with
+    `shapely.coverage_simplify` (shapely 2.1+), so edges shared by adjacent
+    polygons are simplified once and stay shared, without gaps or overlaps
+    between neighbours.
+
+    Args:
+        gdf (gpd.GeoDataFrame): Boundary data.
+        tolerance (float): Simplify tolerance in meters, converted to degrees
+            for data in geographic coordinates.
+
+    Returns:
+        gpd.GeoDataFrame: Copy of `gdf` with simplified geometries.
+    """
+    if gdf.crs is None or gdf.crs.is_geographic:
+        tolerance = tolerance / METERS_PER_DEGREE
+
+    simplified = shapely.coverage_simplify(gdf.geometry.values, tolerance)
+
+    gdf = gdf.copy()
+    gdf[gdf.geometry.name] = gpd.GeoSeries(
+        simplified, index=gdf.index, crs=gdf.crs
+    )
+    return gdf
+
+
+def iter_boundary_batches(
+    path: Union[Path, str], batch_size: int = 10000
+) -> Iterator[gpd.GeoDataFrame]:
+    """
+    Read boundary data in batches of features
+
+    Features are streamed from the file through GDAL's Arrow interface, so
+    only one batch is held in memory at a time regardless of file size.
+
+    Args:
+        path (Union[Path, str]): Path to the boundary file.
+        batch_size (int): Maximum features per batch.
+
+    Yields:
+        gpd.GeoDataFrame: Batches of features.
+    """
+    with pyogrio.open_arrow(path, batch_size=batch_size, use_pyarrow=True) as (
+        meta,
+        reader,
+    ):
+        geometry_name = meta["geometry_name"] or "wkb_geometry"
+        for batch in reader:
+            df = batch.to_pandas()
+            geometry = shapely.from_wkb(df.pop(geometry_name).values)
+            yield gpd.GeoDataFrame(df, geometry=geometry, crs=meta["crs"])
+
+
+class BoundaryBatchWriter:
+    """
+    Write boundary data to a file one batch of features at a time
+
+    The format is based on the file extension, as in `write_boundary`.
+    GeoParquet batches are written as row groups through a single
+    `pyarrow.parquet.ParquetWriter`, with a `bbox` covering column.
+    """
+
+    def __init__(self, path: Union[Path, str], row_group_size: int = 10000):
+        """
+        Args:
+            path (Union[Path, str]): Output path ending in .geojson, .gpkg or
+                .parquet.
+            row_group_size (int): Maximum features per GeoParquet row group.
+        """
+        self.path = Path(path)
+        if self.path.suffix not in FORMAT_EXTENSIONS.values():
+            raise ValueError(
+                f"Unsupported boundary format: {self.path.suffix}"
+            )
+        self.row_group_size = row_group_size
+        self.count = 0
+        self._parquet_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _parquet_schema(
+        self, table: pa.Table, crs: Optional[dict]
+    ) -> pa.Schema:
+        """
+        Build the schema of the GeoParquet file from the first batch
+
+        Columns that are entirely null in the first batch are stored as
+        strings, and no geometry types are declared, since later batches
+        may differ.
+        """
+        fields = [
+            pa.field(i.name, pa.string()) if pa.types.is_null(i.type) else i
+            for i in table.schema
+        ]
+        geo = {
+            "version": "1.1.0",
+            "primary_column": "geometry",
+            "columns": {
+                "geometry": {
+                    "encoding": "WKB",
+                    "geometry_types": [],
+                    "crs": crs,
+                    "covering": {
+                        "bbox": {
+                            "xmin": ["bbox", "xmin"],
+                            "ymin": ["bbox", "ymin"],
+                            "xmax": ["bbox", "xmax"],
+                            "ymax": ["bbox", "ymax"],
+                        }
+                    },
+                }
+            },
+        }
+        return pa.schema(fields, metadata={"geo": json.dumps(geo)})
+
+    def write(self, gdf: gpd.GeoDataFrame):
+        """
+        Write a batch of features
+
+        Args:
+            gdf (gpd.GeoDataFrame): Batch of features.
+        """
+        if self.path.suffix == ".parquet":
+            geoms = gdf.geometry.values
+            bounds = shapely.bounds(geoms)
+            table = pa.Table.from_pandas(
+                pd.DataFrame(gdf.drop(columns=gdf.geometry.name)),
+                preserve_index=False,
+            )
+            table = table.append_column(
+                "geometry", pa.array(shapely.to_wkb(geoms), type=pa.binary())
+            )
+            table = table.append_column(
+                "bbox",
+                pa.StructArray.from_arrays(
+                    [pa.array(bounds[:, i]) for i in range(4)],
+                    names=["xmin", "ymin", "xmax", "ymax"],
+                ),
+            )
+            if self._parquet_writer is None:
+                crs = gdf.crs.to_json_dict() if gdf.crs else None
+                self._parquet_writer = pq.ParquetWriter(
+                    self.path, self._parquet_schema(table, crs)
+                )
+            table = table.cast(self._parquet_writer.schema)
+            self._parquet_writer.write_table(
+                table, row_group_size=self.row_group_size
+            )
+        elif self.path.suffix == ".gpkg":
+            # the layer geometry type is set by the first batch, so promote
+            # all geometries to multi types in case later batches differ
+            gdf.to_file(
+                self.path,
+                driver="GPKG",
+                mode="a" if self.count else "w",
+                promote_to_multi=True,
+            )
+        else:
+            gdf.to_file(
+                self.path, driver="GeoJSON", mode="a" if self.count else "w"
+            )
+        self.count += len(gdf)
+
+    def close(self):
+        """Finish writing the file"""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+
+def assign_largest_overlap(
+    children: gpd.GeoDataFrame,
+    parents: gpd.GeoDataFrame,
+    parent_fields: List[str],
+    coarse_children: Optional[gpd.GeoSeries] = None,
+    coarse_parents: Optional[gpd.GeoSeries] = None,
+    coarse_threshold: float = 0.9,
+) -> pd.DataFrame:
+    """
+    Assign each child polygon to the parent polygon it overlaps the most
+
+    Candidate (child, parent) pairs come from an STRtree query, and their
+    intersection areas are computed with shapely's vectorized array
+    functions, so no geometry columns are duplicated across joined rows.
+
+    If simplified versions of the polygons are given, the overlaps are first
+    computed on them. Children with a coarse match of at least
+    `coarse_threshold` keep that parent as their only candidate, so the
+    expensive full resolution intersection is only computed once for them.
+    Overlaps in the result are always computed at full resolution.
+
+    Args:
+        children (gpd.GeoDataFrame): Child polygons (e.g. ADM2).
+        parents (gpd.GeoDataFrame): Parent polygons (e.g. ADM1), in the same
+            CRS as the children.
+        parent_fields (List[str]): Parent fields to include in the result.
+        coarse_children (gpd.GeoSeries): Simplified child polygons, indexed
+            like `children`. Missing children are matched at full resolution.
+        coarse_parents (gpd.GeoSeries): Simplified parent polygons, indexed
+            like `parents`.
+        coarse_threshold (float): Minimum coarse overlap for a child to skip
+            the full resolution comparison with other candidate parents.
+
+    Returns:
+        pd.DataFrame: Indexed like `children`, with the `parent_fields` of the
+            best matching parent and an `overlap` column holding the fraction
+            of the child's area within that parent. Children that do not
+            intersect any parent are not included.
+    """
+    child_geoms = children.geometry.values
+    parent_geoms = parents.geometry.values
+
+    tree = shapely.STRtree(parent_geoms)
+    child_idx, parent_idx = tree.query(child_geoms, predicate="intersects")
+
+    if coarse_children is not None and coarse_parents is not None:
+        coarse_child_geoms = np.asarray(
+            coarse_children.reindex(children.index).values, dtype=object
+        )
+        coarse_parent_geoms = np.asarray(
+            coarse_parents.reindex(parents.index).values, dtype=object
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            coarse_overlap = shapely.area(
+                shapely.intersection(
+                    coarse_child_geoms[child_idx],
+                    coarse_parent_geoms[parent_idx],
+                )
+            ) / shapely.area(coarse_child_geoms[child_idx])
+
+        # drop the other candidates of children with a confident coarse match
+        confident = np.nan_to_num(coarse_overlap) >= coarse_threshold
+        resolved = np.zeros(len(children), dtype=bool)
+        resolved[child_idx[confident]] = True
+        candidates = confident | ~resolved[child_idx]
+        child_idx = child_idx[candidates]
+        parent_idx = parent_idx[candidates]
+
+    overlap = shapely.area(
+        shapely.intersection(child_geoms[child_idx], parent_geoms[parent_idx])
+    ) / shapely.area(child_geoms[child_idx])
+
+    # order pairs by child then by descending overlap and keep the first
+    # pair for each child
+    order = np.lexsort((-overlap, child_idx))
+    child_idx = child_idx[order]
+    keep = np.ones(len(child_idx), dtype=bool)
+    keep[1:] = child_idx[1:] != child_idx[:-1]
+
+    child_idx = child_idx[keep]
+    parent_idx = parent_idx[order][keep]
+
+    result = parents[parent_fields].iloc[parent_idx].reset_index(drop=True)
+    result["overlap"] = overlap[order][keep]
+    result.index = children.index[child_idx]
+    return result
@@ -0,0 +1,537 @@
+"""
+Zonal statistics for categorical rasters
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import rasterio
+import rasterio.features
+from rasterio.windows import Window
+
+from raster_utils import BlockHistogram, get_aoi_window
+
+
+class CategoricalZonalStats:
+    """
+    Per zone class counts for categorical rasters
+
+    Zones are rasterized once into an integer label grid aligned to the
+    raster, then the counts for every zone and class are computed with a
+    single `np.bincount` over combined (zone, class) keys. Rasters sharing a
+    grid (e.g. multiple years of land cover) reuse the same label grid.
+
+    The label grid assigns each pixel to the zone containing its center.
+    With `all_touched`, pixels along zone boundaries are also counted for
+    every other zone that touches them (see `get_edge_pixels`), matching
+    `rasterstats.zonal_stats` regardless of the order of the zones. Zones
+    are assumed not to overlap.
+    """
+
+    def __init__(
+        self,
+        zones: gpd.GeoDataFrame,
+        id_field: str,
+        all_touched: bool = True,
+        strip_rows: int = 1024,
+        use_histograms: bool = True,
+    ):
+        """
+        Args:
+            zones (gpd.GeoDataFrame): Zone polygons.
+            id_field (str): Field with a unique id for each zone.
+            all_touched (bool): Include all pixels touched by a zone rather
+                than only those whose center is within it.
+            strip_rows (int): Number of raster rows read at a time.
+            use_histograms (bool): Use `BlockHistogram` sidecars of rasters
+                when available.
+        """
+        if zones[id_field].duplicated().any():
+            raise ValueError(f"Zone ids in {id_field} are not unique")
+
+        self.zones = zones
+        self.id_field = id_field
+        self.all_touched = all_touched
+        self.strip_rows = strip_rows
+        self.use_histograms = use_histograms
+
+        # label grids and edge pixels cached by raster grid (crs, transform
+        # and shape)
+        self._labels = {}
+        self._edges = {}
+
+    @property
+    def zone_ids(self) -> pd.Index:
+        return pd.Index(self.zones[self.id_field], name=self.id_field)
+
+    def get_zones(self, src: rasterio.DatasetReader) -> gpd.GeoDataFrame:
+        """Get the zones in the CRS of a raster"""
+        zones = self.zones
+        if zones.crs is not None and src.crs and zones.crs != src.crs:
+            zones = zones.to_crs(src.crs)
+        return zones
+
+    def get_labels(
+        self, src: rasterio.DatasetReader
+    ) -> Tuple[Window, np.ndarray]:
+        """
+        Rasterize the zones onto the grid of a raster
+
+        Each pixel is labelled with the zone containing its center.
+
+        Args:
+            src (rasterio.DatasetReader): Raster defining the grid.
+
+        Returns:
+            Tuple[Window, np.ndarray]: Window of the raster covering all zones
+                and the label grid for that window, where 0 is outside all
+                zones and `i + 1` is the i-th zone.
+        """
+        grid_key = (src.crs, src.transform, src.width, src.height)
+        if grid_key in self._labels:
+            return self._labels[grid_key]
+
+        zones = self.get_zones(src)
+
+        window = get_aoi_window(
+            src.transform, src.width, src.height, zones.total_bounds
+        )
+        dtype = "uint16" if len(zones) < np.iinfo("uint16").max else "uint32"
+
+        labels = rasterio.features.rasterize(
+            zip(zones.geometry, range(1, len(zones) + 1)),
+            out_shape=(int(window.height), int(window.width)),
+            transform=src.window_transform(window),
+            fill=0,
+            all_touched=False,
+            dtype=dtype,
+        )
+
+        self._labels[grid_key] = (window, labels)
+        return window, labels
+
+    def get_edge_pixels(
+        self, src: rasterio.DatasetReader
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find the pixels touched by a zone but labelled with another zone
+
+        A pixel on the boundary between two zones is touched by both, but the
+        label grid only holds the zone containing its center. The boundary
+        of each zone is rasterized separately with `all_touched`, and every
+        touched pixel with a different label is listed so it can be counted
+        for that zone as well.
+
+        Args:
+            src (rasterio.DatasetReader): Raster defining the grid.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Rows and columns
+                (within the window of `get_labels`) and zone labels of the
+                edge pixels, sorted by row.
+        """
+        grid_key = (src.crs, src.transform, src.width, src.height)
+        if grid_key in self._edges:
+            return self._edges[grid_key]
+
+        window, labels = self.get_labels(src)
+        transform = src.window_transform(window)
+        height, width = labels.shape
+
+        rows, cols, zone_labels = [], [], []
+        for label, geom in enumerate(self.get_zones(src).geometry, start=1):
+            if geom is None or geom.is_empty:
+                continue
+            try:
+                zone_window = get_aoi_window(
+                    transform, width, height, geom.bounds
+                )
+            except rasterio.errors.WindowError:
+                # the zone is outside the raster and touches no pixels
+                continue
+            row, col = int(zone_window.row_off), int(zone_window.col_off)
+            zone_height, zone_width = (
+                int(zone_window.height),
+                int(zone_window.width),
+            )
+
+            touched = rasterio.features.rasterize(
+                [geom.boundary],
+                out_shape=(zone_height, zone_width),
+                transform=rasterio.windows.transform(zone_window, transform),
+                fill=0,
+                all_touched=True,
+                dtype="uint8",
+            ).astype(bool)
+            touched &= (
+                labels[row : row + zone_height, col : col + zone_width]
+                != label
+            )
+
+            zone_rows, zone_cols = np.nonzero(touched)
+            rows.append(zone_rows + row)
+            cols.append(zone_cols + col)
+            zone_labels.append(np.full(zone_rows.size, label, labels.dtype))
+
+        rows = np.concatenate(rows or [np.zeros(0, np.int64)])
+        order = np.argsort(rows, kind="stable")
+        edges = (
+            rows[order],
+            np.concatenate(cols or [np.zeros(0, np.int64)])[order],
+            np.concatenate(zone_labels or [np.zeros(0, labels.dtype)])[order],
+        )
+
+        self._edges[grid_key] = edges
+        return edges
+
+    def counts(self, raster_path: Union[Path, str]) -> np.ndarray:
+        """
+        Count pixels of each class within each zone
+
+        Pixels equal to the raster's nodata value are not counted.
+
+        Args:
+            raster_path (Union[Path, str]): Path to a single band categorical
+                raster with an 8 or 16 bit unsigned integer dtype.
+
+        Returns:
+            np.ndarray: Array of shape (number of zones, number of possible
+                class values) where [i, v] is the count of value v in zone i.
+        """
+        return self.band_counts(raster_path, [1])[0]
+
+    def band_counts(
+        self,
+        raster_path: Union[Path, str],
+        bands: List[int],
+        values: Optional[Sequence[int]] = None,
+    ) -> np.ndarray:
+        """
+        Count pixels of each class within each zone for several bands
+
+        All bands of a strip are read in a single call, so a multi-band
+        stack (e.g. one band per year) is read once rather than once per
+        band. Rasters with a current `BlockHistogram` sidecar for every
+        band are counted block by block instead, see `histogram_counts`.
+
+        Args:
+            raster_path (Union[Path, str]): Path to a categorical raster with
+                an 8 or 16 bit unsigned integer dtype.
+            bands (List[int]): Bands to count (1-based).
+            values (Sequence[int]): Class values to count, other values are
+                ignored. Counts are indexed by every possible class value if
+                not set, which for 16 bit rasters with many zones can be
+                large (the counts take 8 bytes per zone and value).
+
+        Returns:
+            np.ndarray: Array of shape (number of bands, number of zones,
+                number of possible class values), or (number of bands,
+                number of zones, number of `values`) if `values` is set.
+        """
+        with rasterio.open(raster_path) as src:
+            dtype = np.dtype(src.dtypes[0])
+            if dtype not in (np.uint8, np.uint16):
+                raise ValueError(f"Unsupported categorical dtype: {dtype}")
+            n_values = int(np.iinfo(dtype).max) + 1
+
+            # map class values to their index in `values`, with one extra
+            # index for all other values that is dropped from the result
+            lut = None
+            if values is not None:
+                lut = np.full(n_values, len(values), dtype=np.int64)
+                lut[np.asarray(values, dtype=np.int64)] = np.arange(
+                    len(values)
+                )
+                n_values = len(values) + 1
+
+            window, labels = self.get_labels(src)
+            edges = self.get_edge_pixels(src) if self.all_touched else None
+            n_keys = (len(self.zones) + 1) * n_values
+            counts = np.zeros((len(bands), n_keys), dtype=np.int64)
+
+            histograms = None
+            if self.use_histograms and dtype == np.uint8:
+                # single band rasters have one sidecar, multi-band rasters
+                # (e.g. the stack of all years) have one per band
+                histograms = [
+                    BlockHistogram.load(
+                        raster_path, band if src.count > 1 else None
+                    )
+                    for band in bands
+                ]
+                if any(
+                    i is None
+                    or i.width != src.width
+                    or i.height != src.height
+                    or i.block_size != histograms[0].block_size
+                    for i in histograms
+                ):
+                    histograms = None
+
+            if histograms is not None:
+                self.histogram_counts(
+                    src,
+                    bands,
+                    histograms,
+                    window,
+                    labels,
+                    edges,
+                    counts,
+                    lut,
+                )
+            else:
+                for row in range(0, labels.shape[0], self.strip_rows):
+                    strip_labels = labels[row : row + self.strip_rows]
+                    strip_window = Window(
+                        window.col_off,
+                        window.row_off + row,
+                        window.width,
+                        strip_labels.shape[0],
+                    )
+                    if edges is not None:
+                        start, end = np.searchsorted(
+                            edges[0], [row, row + strip_labels.shape[0]]
+                        )
+                        edge_rows, edge_cols, edge_labels = (
+                            i[start:end] for i in edges
+                        )
+                    strip_data = src.read(bands, window=strip_window)
+                    for i, data in enumerate(strip_data):
+                        self.add_pixel_counts(
+                            counts[i], strip_labels, data, src.nodata, lut
+                        )
+                        if edges is not None:
+                            self.add_pixel_counts(
+                                counts[i],
+                                edge_labels,
+                                data[edge_rows - row, edge_cols],
+                                src.nodata,
+                                lut,
+                            )
+
+        counts = counts.reshape(len(bands), -1, n_values)[:, 1:]
+        if lut is not None:
+            counts = counts[:, :, :-1]
+        return counts
+
+    @staticmethod
+    def add_pixel_counts(
+        counts: np.ndarray,
+        labels: np.ndarray,
+        data: np.ndarray,
+        nodata=None,
+        lut: Optional[np.ndarray] = None,
+    ):
+        """
+        Add the (zone, class) counts of a window of pixels
+
+        Args:
+            counts (np.ndarray): Flat counts of shape (number of zones + 1) *
+                number of possible class values, updated in place.
+            labels (np.ndarray): Zone labels of the pixels.
+            data (np.ndarray): Class values of the pixels, the same shape as
+                `labels`.
+            nodata: Nodata value, not counted.
+            lut (np.ndarray): Lookup table from class value to the index it
+                is counted at, defaults to the class value itself.
+        """
+        if lut is None:
+            n_values = int(np.iinfo(data.dtype).max) + 1
+        else:
+            n_values = int(lut.max()) + 1
+
+        mask = labels > 0
+        if nodata is not None:
+            mask &= data != nodata
+
+        keys = labels[mask].astype(np.int64) * n_values
+        keys += data[mask] if lut is None else lut[data[mask]]
+        if keys.size * 8 < counts.size:
+            # a full bincount for a small window would be mostly zeros, so
+            # only count the keys that are present
+            keys, key_counts = np.unique(keys, return_counts=True)
+            counts[keys] += key_counts
+        else:
+            counts += np.bincount(keys, minlength=counts.size)
+
+    def histogram_counts(
+        self,
+        src: rasterio.DatasetReader,
+        bands: List[int],
+        histograms: List[BlockHistogram],
+        window: Window,
+        labels: np.ndarray,
+        edges: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+        counts: np.ndarray,
+        lut: Optional[np.ndarray] = None,
+    ):
+        """
+        Count classes block by block, using the histogram sidecars for
+        blocks entirely within a single zone
+
+        Only blocks along zone edges are read (for all bands at once), which
+        avoids reading most of the raster for large zones.
+
+        Args:
+            src (rasterio.DatasetReader): The raster.
+            bands (List[int]): Bands to count (1-based).
+            histograms (List[BlockHistogram]): Block counts of each band,
+                with the same block size.
+            window (Window): Window of the raster covered by `labels`.
+            labels (np.ndarray): Zone labels of the window.
+            edges (Tuple[np.ndarray, np.ndarray, np.ndarray]): Edge pixels
+                from `get_edge_pixels`, or None.
+            counts (np.ndarray): Flat counts of each band, updated in place.
+            lut (np.ndarray): Lookup table from class value to the index it
+                is counted at, see `add_pixel_counts`.
+        """
+        n_hist_values = BlockHistogram.n_values
+        n_values = n_hist_values if lut is None else int(lut.max()) + 1
+        block_size = histograms[0].block_size
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        row_end, col_end = row_off + labels.shape[0], col_off + labels.shape[1]
+        n_block_cols = -(-src.width // block_size)
+
+        # group the edge pixels by the block they fall in
+        if edges is None:
+            edges = tuple(np.zeros(0, np.int64) for _ in range(3))
+        edge_blocks = (edges[0] + row_off) // block_size * n_block_cols + (
+            edges[1] + col_off
+        ) // block_size
+        order = np.argsort(edge_blocks, kind="stable")
+        edge_blocks = edge_blocks[order]
+        edges = tuple(i[order] for i in edges)
+
+        for block_row in range(
+            row_off // block_size, -(-row_end // block_size)
+        ):
+            for block_col in range(
+                col_off // block_size, -(-col_end // block_size)
+            ):
+                block = Window(
+                    block_col * block_size,
+                    block_row * block_size,
+                    block_size,
+                    block_size,
+                ).intersection(Window(0, 0, src.width, src.height))
+                part = block.intersection(window)
+
+                # position of the block within the label grid
+                row = int(part.row_off) - row_off
+                col = int(part.col_off) - col_off
+                block_labels = labels[
+                    row : row + int(part.height), col : col + int(part.width)
+                ]
+                start, end = np.searchsorted(
+                    edge_blocks,
+                    [
+                        block_row * n_block_cols + block_col,
+                        block_row * n_block_cols + block_col + 1,
+                    ],
+                )
+                zone = block_labels.flat[0]
+                if (
+                    part == block
+                    and start == end
+                    and zone > 0
+                    and (block_labels == zone).all()
+                ):
+                    for i, histogram in enumerate(histograms):
+                        block_counts = histogram.counts[block_row, block_col]
+                        block_counts = block_counts.astype(np.int64)
+                        if (
+                            src.nodata is not None
+                            and 0 <= src.nodata < n_hist_values
+                        ):
+                            block_counts[int(src.nodata)] = 0
+                        if lut is not None:
+                            block_counts = np.bincount(
+                                lut[:n_hist_values],
+                                weights=block_counts,
+                                minlength=n_values,
+                            ).astype(np.int64)
+                        counts[
+                            i, zone * n_values : (zone + 1) * n_values
+                        ] += block_counts
+                elif block_labels.any() or start < end:
+                    edge_rows, edge_cols, edge_labels = (
+                        i[start:end] for i in edges
+                    )
+                    block_data = src.read(bands, window=part)
+                    for i, data in enumerate(block_data):
+                        self.add_pixel_counts(
+                            counts[i], block_labels, data, src.nodata, lut
+                        )
+                        self.add_pixel_counts(
+                            counts[i],
+                            edge_labels,
+                            data[edge_rows - row, edge_cols - col],
+                            src.nodata,
+                            lut,
+                        )
+
+    def to_frame(
+        self,
+        raster_items: Dict[
+            str, Union[Path, str, Tuple[Union[Path, str], int]]
+        ],
+        category_map: Optional[Dict[int, str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Build a table of class counts per zone for one or more rasters
+
+        Args:
+            raster_items (Dict[str, Union[Path, str, Tuple]]): Raster id
+                mapped to a raster path, or to a (path, band) tuple for bands
+                of a multi-band raster. Bands of the same raster are read
+                together. Raster ids are used as column prefixes.
+            category_map (Dict[int, str]): Class value mapped to class name.
+                Every class in the map gets a column, other classes only get a
+                (numbered) column if they occur. The nodata value of a raster
+                never gets a column, as it is not counted.
+
+        Returns:
+            pd.DataFrame: Counts indexed by zone id with columns named
+                `{raster_id}_{class name}`.
+        """
+        category_map = category_map or {}
+
+        # group the bands to count by raster
+        raster_bands = {}
+        for raster_id, item in raster_items.items():
+            raster_path, band = item if isinstance(item, tuple) else (item, 1)
+            raster_bands.setdefault(str(raster_path), []).append(
+                (raster_id, band)
+            )
+
+        item_counts = {}
+        item_nodata = {}
+        for raster_path, items in raster_bands.items():
+            with rasterio.open(raster_path) as src:
+                nodata = src.nodata
+            counts = self.band_counts(raster_path, [i[1] for i in items])
+            for (raster_id, _), band_counts in zip(items, counts):
+                item_counts[raster_id] = band_counts
+                item_nodata[raster_id] = nodata
+
+        frames = []
+        for raster_id in raster_items:
+            counts = item_counts[raster_id]
+            values = sorted(
+                (set(category_map) | set(np.flatnonzero(counts.sum(axis=0))))
+                - {item_nodata[raster_id]}
+            )
+            frames.append(
+                pd.DataFrame(
+                    counts[:, values],
+                    index=self.zone_ids,
+                    columns=[
+                        f"{raster_id}_{category_map.get(v, v)}" for v in values
+                    ],
+                )
+            )
+
+        return pd.concat(frames, axis=1)